@@ -1,3 +1,5 @@
 from .dicom_conversion import dicom_conversion
+from .labelmap_conversion import labelmap_conversion
+from .batch_conversion import batch_conversion
 from .simulation_classes import Patient_parameters, Treatment_parameters, Simulation_parameters
 from .total_segmentator import run_totalseg
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""
+Batch conversion of many patients and plans to HEDOS NumPy inputs.
+
+A manifest lists one conversion per (patient, plan); every conversion is written to its own
+directory (output_root/<patient>/<plan>), together with a fingerprint of its inputs (conversion.json).
+Conversions whose inputs and options did not change since the last run are skipped, the others
+run in a pool of processes.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from rt_utils.utils import get_n_processes
+
+from .dicom_conversion import dicom_conversion
+from .labelmap_conversion import labelmap_conversion
+
+
+FINGERPRINT_FILE = "conversion.json"
+# manifest keys holding input paths, the other keys (besides patient and plan) are conversion options
+INPUT_KEYS = ("CT", "RTSTRUCT", "RTDOSE", "SEGMENTATIONS")
+
+
+def read_manifest(manifest) -> list:
+    """
+    Conversions of a manifest: a list of dicts, or a .json file holding one, or a .csv file with one row each.
+    Every conversion has a patient, a plan, the CT directory, the RTDOSE file (or a list of them) and either
+    an RTSTRUCT (see dicom_conversion) or SEGMENTATIONS (see labelmap_conversion; RTSTRUCT is then optional).
+    Any other key is passed to the conversion function (e.g. grid, seg_format, groups).
+    In a .csv file, several RTDOSE files or segmentations are separated by ";", and option values are
+    parsed with parse_option (e.g. fractional: false, supersampling: 4, groups: {"lungs": ["lung_left", ...]}).
+    """
+    if isinstance(manifest, str):
+        if manifest.endswith(".csv"):
+            rows = pd.read_csv(manifest, dtype=str).to_dict("records")
+            manifest = []
+            for row in rows:
+                entry = {key: value for key, value in row.items() if isinstance(value, str) and value != ""}
+                for key in ("RTDOSE", "SEGMENTATIONS"):
+                    if key in entry and ";" in entry[key]:
+                        entry[key] = [path.strip() for path in entry[key].split(";")]
+                for key in entry:
+                    if key not in ("patient", "plan") + INPUT_KEYS:
+                        entry[key] = parse_option(entry[key])
+                manifest.append(entry)
+        else:
+            with open(manifest) as f:
+                manifest = json.load(f)
+
+    conversions = []
+    for entry in manifest:
+        for key in ("patient", "plan", "CT", "RTDOSE"):
+            if key not in entry:
+                raise ValueError(f"Manifest entry without {key}: {entry}")
+        if "RTSTRUCT" not in entry and "SEGMENTATIONS" not in entry:
+            raise ValueError(f"Manifest entry without RTSTRUCT or SEGMENTATIONS: {entry}")
+        conversions.append(dict(entry))
+
+    outputs = [(str(entry["patient"]), str(entry["plan"])) for entry in conversions]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError("The manifest holds the same patient and plan more than once")
+    return conversions
+
+
+def parse_option(value: str):
+    """
+    Value of an option column of a .csv manifest: true/false (any case) as bool, numbers as int or float,
+    JSON objects and lists (e.g. groups) as dict and list; anything else is kept as a string.
+    """
+    if value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return value
+
+
+def input_files(conversion: dict) -> list:
+    """All files a conversion reads: the files below the CT and segmentation directories and the other inputs."""
+    files = []
+    for key in INPUT_KEYS:
+        paths = conversion.get(key)
+        if paths is None:
+            continue
+        for path in [paths] if isinstance(paths, str) else paths:
+            if os.path.isdir(path):
+                files.extend(
+                    os.path.join(root, file)
+                    for root, _, dir_files in os.walk(path)
+                    for file in dir_files
+                )
+            else:
+                files.append(path)
+    return sorted(os.path.abspath(path) for path in files)
+
+
+def fingerprint(conversion: dict, hash_inputs: bool = False) -> dict:
+    """
+    Fingerprint of a conversion: its options and, per input file, the size and modification time
+    (or, with hash_inputs, a SHA-1 of the contents, which survives copying the files).
+    """
+    files = {}
+    for path in input_files(conversion):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Input of {conversion['patient']}/{conversion['plan']} not found: {path}")
+        stat = os.stat(path)
+        if hash_inputs:
+            sha1 = hashlib.sha1()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha1.update(block)
+            files[path] = [stat.st_size, sha1.hexdigest()]
+        else:
+            files[path] = [stat.st_size, stat.st_mtime_ns]
+
+    options = {key: value for key, value in conversion.items() if key not in ("patient", "plan")}
+    return {"options": json.loads(json.dumps(options, sort_keys=True, default=str)), "files": files}
+
+
+def conversion_output_dir(output_root: str, conversion: dict) -> str:
+    return os.path.join(output_root, str(conversion["patient"]), str(conversion["plan"]))
+
+
+def is_up_to_date(output_dir: str, conversion_fingerprint: dict) -> bool:
+    """Whether output_dir holds a finished conversion with the same fingerprint."""
+    fingerprint_path = os.path.join(output_dir, FINGERPRINT_FILE)
+    if not os.path.isfile(fingerprint_path) or not os.path.isfile(os.path.join(output_dir, "dose.npy")):
+        return False
+    with open(fingerprint_path) as f:
+        return json.load(f) == conversion_fingerprint
+
+
+def run_conversion(conversion: dict, output_dir: str, conversion_fingerprint: dict) -> None:
+    """
+    Run a single conversion of a manifest into output_dir. The fingerprint is written when it is done,
+    so an interrupted or failed conversion is never taken for an up-to-date one.
+    The conversion runs serially unless the manifest sets n_workers: batch_conversion already runs
+    one conversion per process, so nested pools would start processes on every core for each of them.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    fingerprint_path = os.path.join(output_dir, FINGERPRINT_FILE)
+    if os.path.isfile(fingerprint_path):
+        os.remove(fingerprint_path)
+
+    options = {
+        key: value for key, value in conversion.items()
+        if key not in ("patient", "plan") + INPUT_KEYS
+    }
+    options.setdefault("n_workers", 1)
+    if "SEGMENTATIONS" in conversion:
+        labelmap_conversion(
+            conversion["CT"], conversion["SEGMENTATIONS"], conversion["RTDOSE"],
+            RTSTRUCT_PATH=conversion.get("RTSTRUCT"), output_dir=output_dir, **options,
+        )
+    else:
+        dicom_conversion(
+            conversion["CT"], conversion["RTSTRUCT"], conversion["RTDOSE"], output_dir=output_dir, **options
+        )
+
+    with open(fingerprint_path, "w") as f:
+        json.dump(conversion_fingerprint, f)
+
+
+def _run_conversion_job(conversion: dict, output_dir: str, conversion_fingerprint: dict):
+    """Worker of batch_conversion: returns None on success, the error message otherwise."""
+    try:
+        run_conversion(conversion, output_dir, conversion_fingerprint)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def batch_conversion(
+    manifest,
+    output_root: str,
+    n_workers: int = None,
+    hash_inputs: bool = False,
+    force: bool = False,
+) -> dict:
+    """
+    Convert all patients and plans of a manifest (see read_manifest) to output_root/<patient>/<plan>,
+    in a pool of n_workers processes (see rt_utils.utils.get_n_processes; -1 for all cores).
+    Conversions whose inputs (size and modification time, or contents with hash_inputs) and options did not
+    change since the last run are skipped, unless force is set. A failing conversion does not stop the others.
+    Returns (patient, plan) -> "skipped", "converted" or the error of a failed conversion.
+    """
+    conversions = read_manifest(manifest)
+    keys = [(str(conversion["patient"]), str(conversion["plan"])) for conversion in conversions]
+    status = {}
+    jobs = []
+    for key, conversion in zip(keys, conversions):
+        output_dir = conversion_output_dir(output_root, conversion)
+        try:
+            conversion_fingerprint = fingerprint(conversion, hash_inputs)
+        except FileNotFoundError as e:
+            status[key] = f"FileNotFoundError: {e}"
+            continue
+        if not force and is_up_to_date(output_dir, conversion_fingerprint):
+            status[key] = "skipped"
+        else:
+            jobs.append((key, conversion, output_dir, conversion_fingerprint))
+
+    print(f"[BATCH] {len(jobs)} of {len(conversions)} conversions to run")
+    if jobs:
+        with ProcessPoolExecutor(max_workers=get_n_processes(n_workers)) as executor:
+            errors = executor.map(
+                _run_conversion_job,
+                [job[1] for job in jobs],
+                [job[2] for job in jobs],
+                [job[3] for job in jobs],
+            )
+            for (key, _, _, _), error in zip(jobs, errors):
+                status[key] = "converted" if error is None else error
+                if error is not None:
+                    print(f"[BATCH] {key[0]}/{key[1]} failed: {error}")
+
+    n_converted = sum(value == "converted" for value in status.values())
+    n_skipped = sum(value == "skipped" for value in status.values())
+    print(f"[BATCH] done: {n_converted} converted, {n_skipped} skipped, "
+          f"{len(status) - n_converted - n_skipped} failed")
+    return {key: status[key] for key in keys}
@@ -8,10 +8,12 @@ Modifications:
 """
 
 import os
+import json
+import re
 import numpy as np
 import pydicom
 import SimpleITK as sitk
-from rt_utils import RTStructBuilder
+from rt_utils import RTStructBuilder, image_helper
 
 # NOTE:
 # RTSTRUCT handling in this pipeline relies on a locally modified rt-utils
@@ -24,20 +26,34 @@ def _norm(name: str) -> str:
     return name.strip().lower().replace(" ", "_")
 
 def load_dicom_series(directory: str) -> sitk.Image:
-    """Load a DICOM CT series using SimpleITK."""
-    reader = sitk.ImageSeriesReader()
-    series_IDs = reader.GetGDCMSeriesIDs(directory)
-    if not series_IDs:
-        raise ValueError(f"No DICOM series found in directory: {directory}")
-
-    series_file_names = reader.GetGDCMSeriesFileNames(directory, series_IDs[0])
-    reader.SetFileNames(series_file_names)
-    return reader.Execute()
+    """
+    Load the geometry of a DICOM CT series as an (empty) SimpleITK image.
+    Only the headers are read, through the series cache that RTStructBuilder shares,
+    so the series is read once per process however many steps use it.
+    """
+    series_data = image_helper.load_sorted_image_series(directory)
+
+    first_slice = series_data[0]
+    row_direction, column_direction, slice_direction = image_helper.get_slice_directions(first_slice)
+    row_spacing, column_spacing = [float(x) for x in first_slice.PixelSpacing]
+    slice_spacing = float(image_helper.get_spacing_between_slices(series_data))
+
+    ct_image = sitk.Image(int(first_slice.Columns), int(first_slice.Rows), len(series_data), sitk.sitkUInt8)
+    ct_image.SetSpacing((column_spacing, row_spacing, slice_spacing))
+    ct_image.SetOrigin([float(v) for v in first_slice.ImagePositionPatient])
+    ct_image.SetDirection(
+        np.stack([row_direction, column_direction, slice_direction], axis=1).ravel().tolist()
+    )
+    return ct_image
 
 
 def load_dose_image(rtdose_path: str) -> sitk.Image:
-    """Load RTDOSE as a SimpleITK image with spacing and origin."""
-    dose_ds = pydicom.dcmread(rtdose_path)
+    """Load RTDOSE as a SimpleITK image with spacing, origin and direction."""
+    return dose_image_from_dataset(pydicom.dcmread(rtdose_path))
+
+
+def dose_image_from_dataset(dose_ds) -> sitk.Image:
+    """SimpleITK image of an RTDOSE dataset that is already read (see load_dose_image)."""
 
     dose_array = dose_ds.pixel_array.astype(np.float32)
     scaling = float(getattr(dose_ds, "DoseGridScaling", 1.0))
@@ -58,9 +74,106 @@ def load_dose_image(rtdose_path: str) -> sitk.Image:
     if hasattr(dose_ds, "ImagePositionPatient"):
         dose_image.SetOrigin([float(v) for v in dose_ds.ImagePositionPatient])
 
+    if hasattr(dose_ds, "ImageOrientationPatient"):
+        row_direction, column_direction, slice_direction = image_helper.get_slice_directions(dose_ds)
+        dose_image.SetDirection(
+            np.stack([row_direction, column_direction, slice_direction], axis=1).ravel().tolist()
+        )
+
     return dose_image
 
 
+def get_beam_name(dose_ds, default: str) -> str:
+    """Name of the beam of a per-beam RTDOSE ("beam_<referenced beam number>"), default for other doses."""
+    if getattr(dose_ds, "DoseSummationType", "") != "BEAM":
+        return default
+    try:
+        plan = dose_ds.ReferencedRTPlanSequence[0]
+        beam = plan.ReferencedFractionGroupSequence[0].ReferencedBeamSequence[0]
+        return f"beam_{int(beam.ReferencedBeamNumber)}"
+    except (AttributeError, IndexError):
+        return default
+
+
+def sum_dose_images(rtdose_paths: list, reference: sitk.Image = None, beam_dir: str = None) -> sitk.Image:
+    """
+    Sum RTDOSE files (e.g. one per beam) on the grid of reference (by default the grid of the first file).
+    The files are read one at a time and added to a running total, so only one of them is in memory at once.
+    With beam_dir, every dose is also saved there on the same grid, in the layout of the HEDOS dose
+    (<beam name>.npy), with a manifest (beams.json) holding the beam order.
+    """
+    _remove_beam_doses(beam_dir)
+    total = None
+    beam_names = []
+    for i, rtdose_path in enumerate(rtdose_paths):
+        dose_ds = pydicom.dcmread(rtdose_path)
+        dose_image = dose_image_from_dataset(dose_ds)
+        if reference is None:
+            reference = dose_image
+        elif not _same_grid(dose_image, reference):
+            dose_image = resample_to_reference(dose_image, reference, is_label=False)
+        dose_array = sitk.GetArrayFromImage(dose_image)
+        total = dose_array if total is None else total + dose_array
+
+        if beam_dir is not None:
+            beam_name = get_beam_name(dose_ds, f"dose_{i + 1}")
+            base_name, n = beam_name, 2
+            while beam_name in beam_names:
+                beam_name = f"{base_name}_{n}"
+                n += 1
+            os.makedirs(beam_dir, exist_ok=True)
+            np.save(os.path.join(beam_dir, beam_name + ".npy"), np.transpose(dose_array, (1, 2, 0)))
+            beam_names.append(beam_name)
+        del dose_ds, dose_image, dose_array
+
+    if beam_dir is not None:
+        with open(os.path.join(beam_dir, "beams.json"), "w") as f:
+            json.dump({"beams": beam_names}, f)
+
+    total_image = sitk.GetImageFromArray(total)
+    total_image.CopyInformation(reference)
+    return total_image
+
+
+def _same_grid(image: sitk.Image, reference: sitk.Image) -> bool:
+    return (
+        image.GetSize() == reference.GetSize()
+        and np.allclose(image.GetSpacing(), reference.GetSpacing())
+        and np.allclose(image.GetOrigin(), reference.GetOrigin())
+        and np.allclose(image.GetDirection(), reference.GetDirection())
+    )
+
+
+def _remove_beam_doses(beam_dir: str) -> None:
+    """Remove the files of an existing set of per-beam doses (see sum_dose_images)."""
+    if beam_dir is None:
+        return
+    manifest_path = os.path.join(beam_dir, "beams.json")
+    if not os.path.isfile(manifest_path):
+        return
+    with open(manifest_path) as f:
+        beam_names = json.load(f)["beams"]
+    for beam_name in beam_names:
+        path = os.path.join(beam_dir, beam_name + ".npy")
+        if os.path.isfile(path):
+            os.remove(path)
+    os.remove(manifest_path)
+
+
+def load_plan_dose(RTDOSE_PATH, reference: sitk.Image = None, output_dir: str = None) -> sitk.Image:
+    """
+    Load the dose of a plan from one RTDOSE file or a list of them (e.g. one per beam), which are summed.
+    With a list and output_dir, the dose of every file is kept in output_dir/beam_doses (see sum_dose_images).
+    The dose is resampled onto reference if given.
+    """
+    beam_dir = os.path.join(output_dir, "beam_doses") if output_dir is not None else None
+    if isinstance(RTDOSE_PATH, str):
+        _remove_beam_doses(beam_dir)
+        dose_image = load_dose_image(RTDOSE_PATH)
+        return dose_image if reference is None else resample_to_reference(dose_image, reference, is_label=False)
+    return sum_dose_images(list(RTDOSE_PATH), reference, beam_dir)
+
+
 def resample_to_reference(
     image: sitk.Image, reference: sitk.Image, is_label: bool
 ) -> sitk.Image:
@@ -75,15 +188,19 @@ def resample_to_reference(
 
 
 def extract_structures(
-    rtstruct_path: str, ct_series_dir: str, ct_image: sitk.Image
+    rtstruct_path: str, ct_series_dir: str, ct_image: sitk.Image, n_workers: int = None
 ) -> dict:
-    """Rasterize RTSTRUCT ROIs as masks aligned to the CT grid."""
+    """
+    Rasterize RTSTRUCT ROIs as masks aligned to the CT grid.
+    Slabs of slices are rasterized in n_workers processes (see rt_utils.utils.get_n_processes).
+    """
     rtb = RTStructBuilder.create_from( #Using Rtstruct builder, with removing collapsed polygons
         dicom_series_path=ct_series_dir,
         rt_struct_path=rtstruct_path,
     )
 
     structure_masks = {}
+    rtb.get_cropped_roi_masks(n_workers=n_workers)  # rasterize all ROIs in one pass, the masks below come from the cache
 
     for roi_name in rtb.get_roi_names():
         mask_np = rtb.get_roi_mask_by_name(roi_name)
@@ -91,7 +208,8 @@ def extract_structures(
             continue
 
         name = _norm(roi_name)
-        mask_img = sitk.GetImageFromArray(mask_np.astype(np.uint8))
+        # rt_utils masks are (row, column, slice), SimpleITK arrays (slice, row, column)
+        mask_img = sitk.GetImageFromArray(np.transpose(mask_np, (2, 0, 1)).astype(np.uint8))
         mask_img.SetSpacing(ct_image.GetSpacing())
         mask_img.SetOrigin(ct_image.GetOrigin())
         mask_img.SetDirection(ct_image.GetDirection())
@@ -101,19 +219,241 @@ def extract_structures(
     return structure_masks
 
 
+def extract_structure_fractions(
+    rtstruct_path: str, ct_series_dir: str, ct_image: sitk.Image, supersampling: int = 4
+) -> dict:
+    """
+    Rasterize RTSTRUCT ROIs as partial-volume fractions on the CT grid, see RTStruct.get_roi_fractions.
+    Every ROI is kept cropped to its bounding box, as (bbox, float16 fractions) as crop_to_bounding_box;
+    float16 holds the fractions of up to 16 x 16 samples per pixel exactly.
+    """
+    rtb = RTStructBuilder.create_from(
+        dicom_series_path=ct_series_dir,
+        rt_struct_path=rtstruct_path,
+    )
+
+    structure_fractions = {}
+    for roi_name, (bbox, cropped_fractions) in rtb.get_roi_fractions(supersampling=supersampling).items():
+        if bbox is None or not cropped_fractions.any():
+            continue
+        structure_fractions[_norm(roi_name)] = (bbox, cropped_fractions.astype(np.float16))
+
+    return structure_fractions
+
+
+def cropped_image(bbox, cropped: np.ndarray, reference: sitk.Image, margin: int = 1) -> sitk.Image:
+    """
+    Float32 image of an array cropped to bbox (see crop_to_bounding_box) of the grid of reference,
+    padded with margin voxels of zeros (within the grid), so that interpolating it near the edges of
+    the crop gives the same values as interpolating the full-size array.
+    """
+    shape = (reference.GetSize()[1], reference.GetSize()[0], reference.GetSize()[2])
+    padded = tuple(slice(max(b.start - margin, 0), min(b.stop + margin, n)) for b, n in zip(bbox, shape))
+    array = np.zeros(tuple(p.stop - p.start for p in padded), dtype=np.float32)
+    array[tuple(slice(b.start - p.start, b.stop - p.start) for b, p in zip(bbox, padded))] = cropped
+    image = sitk.GetImageFromArray(np.transpose(array, (2, 0, 1)))
+    image.SetSpacing(reference.GetSpacing())
+    image.SetDirection(reference.GetDirection())
+    image.SetOrigin(reference.TransformIndexToPhysicalPoint((padded[1].start, padded[0].start, padded[2].start)))
+    return image
+
+
+def resample_fractions_to_reference(fraction_image: sitk.Image, reference: sitk.Image) -> sitk.Image:
+    """
+    Area-weighted resampling of partial-volume fractions onto a (coarser) reference grid:
+    every reference voxel is split into sub-voxels no larger than the voxels of fraction_image,
+    the fractions are interpolated at their centres and averaged per reference voxel.
+    Only the reference voxels around the bounding box of the nonzero fractions are computed.
+    """
+    fractions = np.zeros(reference.GetSize()[::-1], dtype=np.float32)
+    result = sitk.GetImageFromArray(fractions)
+    result.CopyInformation(reference)
+
+    nonzero = np.nonzero(sitk.GetArrayViewFromImage(fraction_image))
+    if len(nonzero[0]) == 0:
+        return result
+    # corners of the bounding box (x, y, z indices, half a voxel out) in reference indices
+    lo = [int(v.min()) - 0.5 for v in nonzero[::-1]]
+    hi = [int(v.max()) + 0.5 for v in nonzero[::-1]]
+    corners = np.array([
+        reference.TransformPhysicalPointToContinuousIndex(
+            fraction_image.TransformContinuousIndexToPhysicalPoint((x, y, z))
+        )
+        for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])
+    ])
+    start = np.clip(np.floor(corners.min(axis=0) + 0.5).astype(int), 0, None)
+    stop = np.minimum(np.floor(corners.max(axis=0) + 0.5).astype(int) + 1, reference.GetSize())
+    if np.any(stop <= start):
+        return result
+    region = sitk.RegionOfInterest(reference, (stop - start).tolist(), start.tolist())
+
+    factors = np.maximum(
+        np.ceil(np.array(region.GetSpacing()) / np.array(fraction_image.GetSpacing()) - 1e-6), 1
+    ).astype(int)
+    spacing = np.array(region.GetSpacing())
+    direction = np.array(region.GetDirection()).reshape(3, 3)
+    fine = sitk.Image([int(v) for v in np.array(region.GetSize()) * factors], sitk.sitkUInt8)
+    fine.SetSpacing((spacing / factors).tolist())
+    fine.SetDirection(region.GetDirection())
+    # the first sub-voxel centre lies (factor - 1) / 2 sub-voxels before the first voxel centre
+    fine.SetOrigin((np.array(region.GetOrigin()) - direction @ ((factors - 1) / (2 * factors) * spacing)).tolist())
+
+    fine = resample_to_reference(sitk.Cast(fraction_image, sitk.sitkFloat32), fine, is_label=False)
+    (fx, fy, fz), (nx, ny, nz) = factors, region.GetSize()
+    fractions[start[2]:stop[2], start[1]:stop[1], start[0]:stop[0]] = (
+        sitk.GetArrayViewFromImage(fine).reshape(nz, fz, ny, fy, nx, fx).mean(axis=(1, 3, 5))
+    )
+
+    result = sitk.GetImageFromArray(fractions)
+    result.CopyInformation(reference)
+    return result
+
+
+def count_outside_grid(mask_image: sitk.Image, reference: sitk.Image) -> np.ndarray:
+    """
+    Voxel counts per label value of mask_image outside the grid of reference,
+    in units of reference voxels (i.e. scaled by the ratio of the voxel volumes).
+    """
+    labels = sitk.GetArrayViewFromImage(mask_image)
+    outside = outside_grid(mask_image, reference)
+    counts = np.bincount(labels[outside].astype(np.int64).ravel(), minlength=int(labels.max()) + 1)
+    return counts * np.prod(mask_image.GetSpacing()) / np.prod(reference.GetSpacing())
+
+
+def outside_grid(image: sitk.Image, reference: sitk.Image) -> np.ndarray:
+    """Boolean array (in the layout of the array of image) of the voxels of image outside the grid of reference."""
+    inside = sitk.Image(reference.GetSize(), sitk.sitkUInt8) + 1
+    inside.CopyInformation(reference)
+    return sitk.GetArrayViewFromImage(resample_to_reference(inside, image, is_label=True)) == 0
+
+
+def _segmentation_store_files(output_dir: str) -> list:
+    """Files of an existing per-organ segmentation store (see save_segmentation_store)."""
+    manifest_path = os.path.join(output_dir, "segs", "segs.json")
+    if not os.path.isfile(manifest_path):
+        return []
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    files = manifest.get("files", {organ: organ + ".npy" for organ in manifest["organs"]})
+    return [os.path.join(output_dir, "segs", file) for file in files.values()] + [manifest_path]
+
+
+def organ_file_name(organ: str, used: set) -> str:
+    """
+    A file name for an organ that is safe on any file system (e.g. "L/R lung" -> "L_R_lung.npy"),
+    unique (case-insensitively) among the used ones, which it is added to.
+    """
+    base = re.sub(r"[^A-Za-z0-9._-]+", "_", organ).strip("._") or "organ"
+    name, n = base, 2
+    while name.lower() in used:
+        name = f"{base}_{n}"
+        n += 1
+    used.add(name.lower())
+    return name + ".npy"
+
+
+def crop_to_bounding_box(seg: np.ndarray):
+    """
+    A segmentation cropped to the bounding box of its nonzero voxels, as (bbox, cropped segmentation)
+    with bbox a tuple of slices (as RTStruct.get_cropped_roi_masks); (None, None) if there are none.
+    """
+    bbox = []
+    for axis in range(seg.ndim):
+        idx = np.flatnonzero(np.any(seg, axis=tuple(a for a in range(seg.ndim) if a != axis)))
+        if idx.size == 0:
+            return None, None
+        bbox.append(slice(int(idx[0]), int(idx[-1]) + 1))
+    bbox = tuple(bbox)
+    return bbox, seg[bbox]
+
+
+def uncrop(bbox, cropped: np.ndarray, shape, dtype=np.uint8) -> np.ndarray:
+    """The full-size array of a segmentation cropped to bbox (see crop_to_bounding_box)."""
+    seg = np.zeros(shape, dtype=dtype)
+    if bbox is not None:
+        seg[bbox] = cropped
+    return seg
+
+
+def save_segmentation_store(
+    output_dir: str, seg_arrays: dict, packed: bool = False, fractional: bool = False, shape=None
+) -> None:
+    """
+    Save segmentations in output_dir/segs: every organ cropped to its bounding box in an uncompressed .npy file,
+    plus a manifest (segs.json) holding the organ order (= overlap priority), the file name and bounding box
+    of every organ and the full shape. Files can be memory-mapped so that only the requested organs are read.
+    File names are sanitized organ names (see organ_file_name); empty organs have no file.
+    seg_arrays: organ -> full-size array, or (bbox, cropped array) as crop_to_bounding_box; shape is
+                the full shape, only needed if all organs are cropped.
+    With packed=True, masks are bit-packed (8x smaller, unpacked on reading).
+    With fractional=True, the arrays are partial-volume fractions stored as uint8 in units of 1/255.
+    """
+    for path in _segmentation_store_files(output_dir):
+        os.remove(path)
+    seg_dir = os.path.join(output_dir, "segs")
+    os.makedirs(seg_dir, exist_ok=True)
+
+    files = {}
+    bboxes = {}
+    used = set()
+    for organ, seg in seg_arrays.items():
+        if isinstance(seg, tuple):
+            bbox, seg = seg
+        else:
+            shape = seg.shape
+            bbox, seg = crop_to_bounding_box(seg)
+        bboxes[organ] = None if bbox is None else [[b.start, b.stop] for b in bbox]
+        if bbox is None:
+            continue
+        seg = np.packbits(seg.astype(bool), axis=None) if packed else seg.astype(np.uint8)
+        files[organ] = organ_file_name(organ, used)
+        np.save(os.path.join(seg_dir, files[organ]), seg)
+
+    with open(os.path.join(seg_dir, "segs.json"), "w") as f:
+        json.dump(
+            {
+                "organs": list(seg_arrays.keys()),
+                "files": files,
+                "bboxes": bboxes,
+                "shape": list(shape) if shape else None,
+                "packed": packed,
+                "fractional": fractional,
+            },
+            f,
+        )
+
+
 def save_hedos_inputs(
-    ct_image: sitk.Image,
+    grid_image: sitk.Image,
     structure_masks: dict,
     dose_image: sitk.Image,
     output_dir: str,
+    seg_format: str = "npy",
+    outside_voxels: dict = None,
+    fractional: bool = False,
 ) -> None:
-    """Save HEDOS-ready NumPy inputs."""
+    """
+    Save HEDOS-ready NumPy inputs.
+    grid_image: image defining the grid (CT or dose) of the dose and masks, for the affine.
+    structure_masks: organ -> mask, as SimpleITK images or NumPy arrays in the layout of the saved dose,
+                     or as (bbox, cropped array) as crop_to_bounding_box (empty organs: (None, None)).
+    seg_format: "npy" (memory-mappable store, one file per organ cropped to its bounding box),
+                "packed" (the same, bit-packed) or "npz" (single compressed archive of full-size masks).
+    outside_voxels: organ -> number of voxels of the organ outside the grid (see count_outside_grid),
+                    saved to outside_voxels.json.
+    fractional: structure_masks are partial-volume fractions (0..1) rather than binary masks;
+                only the "npy" format can hold them.
+    """
+    if seg_format not in ("npy", "packed", "npz"):
+        raise ValueError(f"Unknown segmentation format: {seg_format}")
+    if fractional and seg_format != "npy":
+        raise ValueError("Fractional segmentations can only be saved in the npy format")
     os.makedirs(output_dir, exist_ok=True)
 
     affine = np.eye(4, dtype=np.float64)
-    spacing = np.array(ct_image.GetSpacing())
-    direction = np.array(ct_image.GetDirection()).reshape(3, 3)
-    origin = np.array(ct_image.GetOrigin())
+    spacing = np.array(grid_image.GetSpacing())
+    direction = np.array(grid_image.GetDirection()).reshape(3, 3)
+    origin = np.array(grid_image.GetOrigin())
 
     affine[:3, :3] = direction @ np.diag(spacing)
     affine[:3, 3] = origin
@@ -124,14 +464,39 @@ def save_hedos_inputs(
     np.save(os.path.join(output_dir, "dose.npy"), dose_array)
     np.save(os.path.join(output_dir, "affine.npy"), affine)
 
-    seg_arrays = {
-        organ: sitk.GetArrayFromImage(mask).astype(np.uint8)
-        for organ, mask in structure_masks.items()
-    }
-
-    np.savez_compressed(
-        os.path.join(output_dir, "compressed_segs.npz"), **seg_arrays
-    )
+    # every organ cropped to its bounding box, as (bbox, uint8 array)
+    seg_arrays = {}
+    for organ, mask in structure_masks.items():
+        if isinstance(mask, sitk.Image):
+            mask = np.transpose(sitk.GetArrayViewFromImage(mask), (1, 2, 0))
+        bbox, seg = mask if isinstance(mask, tuple) else crop_to_bounding_box(mask)
+        if bbox is not None and fractional:
+            seg = np.rint(np.clip(seg.astype(np.float32), 0, 1) * 255).astype(np.uint8)
+        elif bbox is not None:
+            seg = seg.astype(np.uint8)
+        seg_arrays[organ] = (bbox, seg)
+
+    outside_path = os.path.join(output_dir, "outside_voxels.json")
+    if outside_voxels:
+        with open(outside_path, "w") as f:
+            json.dump({organ: float(count) for organ, count in outside_voxels.items()}, f)
+    elif os.path.isfile(outside_path):
+        os.remove(outside_path)
+
+    # only keep one segmentation format, so that a stale one can never be picked up:
+    npz_path = os.path.join(output_dir, "compressed_segs.npz")
+    if seg_format == "npz":
+        for path in _segmentation_store_files(output_dir):
+            os.remove(path)
+        np.savez_compressed(
+            npz_path, **{organ: uncrop(bbox, seg, dose_array.shape) for organ, (bbox, seg) in seg_arrays.items()}
+        )
+    else:
+        if os.path.isfile(npz_path):
+            os.remove(npz_path)
+        save_segmentation_store(
+            output_dir, seg_arrays, packed=(seg_format == "packed"), fractional=fractional, shape=dose_array.shape
+        )
 
     print("[HEDOS] Files written to:", os.path.abspath(output_dir))
     print("[HEDOS] Number of ROIs:", len(seg_arrays))
@@ -147,14 +512,64 @@ def dicom_conversion(
     RTSTRUCT_PATH: str,
     RTDOSE_PATH: str,
     output_dir: str = OUTPUT_DIR,
+    seg_format: str = "npy",
+    n_workers: int = None,
+    grid: str = "ct",
+    fractional: bool = False,
+    supersampling: int = 4,
 ) -> None:
-    """Convert CT + RTSTRUCT + RTDOSE to HEDOS NumPy inputs."""
+    """
+    Convert CT + RTSTRUCT + RTDOSE to HEDOS NumPy inputs.
+    RTDOSE_PATH: one RTDOSE file, or a list of them (e.g. one per beam) that are summed; the dose of every
+                 file is then also saved to output_dir/beam_doses, for beam-resolved dose rates.
+    grid: "ct" resamples the dose onto the CT grid; "dose" keeps the dose on its own (coarser) grid and
+          resamples the structures onto it (nearest neighbour). The parts of the structures outside the
+          dose grid are saved as outside voxel counts.
+    fractional: save partial-volume fractions instead of binary masks (seg_format "npy" only), rasterized
+                with supersampling x supersampling samples per CT pixel and, on the dose grid, area-weighted
+                (see resample_fractions_to_reference). Small structures then keep their volume on coarse grids.
+    """
+    if grid not in ("ct", "dose"):
+        raise ValueError(f"Unknown grid: {grid}")
+    if fractional and seg_format != "npy":
+        raise ValueError("Fractional segmentations can only be saved in the npy format")
     ct_image = load_dicom_series(CT_DIR)
-    dose_image = load_dose_image(RTDOSE_PATH)
+    dose_image = load_plan_dose(RTDOSE_PATH, ct_image if grid == "ct" else None, output_dir)
 
-    structure_masks = extract_structures(RTSTRUCT_PATH, CT_DIR, ct_image)
-    dose_on_ct = resample_to_reference(dose_image, ct_image, is_label=False)
+    if fractional:
+        structure_masks = extract_structure_fractions(RTSTRUCT_PATH, CT_DIR, ct_image, supersampling=supersampling)
+    else:
+        structure_masks = extract_structures(RTSTRUCT_PATH, CT_DIR, ct_image, n_workers=n_workers)
 
-    save_hedos_inputs(ct_image, structure_masks, dose_on_ct, output_dir)
+    if grid == "ct":
+        save_hedos_inputs(
+            ct_image, structure_masks, dose_image, output_dir, seg_format=seg_format, fractional=fractional
+        )
+    elif fractional:
+        # the volume of the structures outside the dose grid, in dose voxels
+        outside = np.transpose(outside_grid(ct_image, dose_image), (1, 2, 0))
+        voxel_ratio = np.prod(ct_image.GetSpacing()) / np.prod(dose_image.GetSpacing())
+        outside_voxels = {}
+        for organ, (bbox, fractions) in list(structure_masks.items()):
+            outside_voxels[organ] = np.sum(fractions[outside[bbox]], dtype=np.float64) * voxel_ratio
+            fraction_image = cropped_image(bbox, fractions, ct_image)
+            structure_masks[organ] = resample_fractions_to_reference(fraction_image, dose_image)
+        save_hedos_inputs(
+            dose_image, structure_masks, dose_image, output_dir,
+            seg_format=seg_format, outside_voxels=outside_voxels, fractional=True,
+        )
+    else:
+        outside_voxels = {
+            organ: count_outside_grid(mask, dose_image)[1:].sum()
+            for organ, mask in structure_masks.items()
+        }
+        structure_masks = {
+            organ: resample_to_reference(mask, dose_image, is_label=True)
+            for organ, mask in structure_masks.items()
+        }
+        save_hedos_inputs(
+            dose_image, structure_masks, dose_image, output_dir,
+            seg_format=seg_format, outside_voxels=outside_voxels,
+        )
 
     print("[HEDOS] NumPy conversion done")
@@ -0,0 +1,187 @@
+"""
+Conversion of segmentation labelmaps (e.g. TotalSegmentator NIfTI output) + RTDOSE to HEDOS NumPy inputs.
+
+Masks go straight from the labelmaps to the HEDOS segmentation store, without the
+mask -> RTSTRUCT contours -> mask round trip of merge_rtstruct + dicom_conversion.
+Only ROIs that exist as contours only (e.g. the tumor) are rasterized from an RTSTRUCT.
+"""
+
+import os
+import numpy as np
+import SimpleITK as sitk
+from scipy.ndimage import find_objects
+from rt_utils import RTStructBuilder, image_helper
+from rt_utils.nifti2rt import save_masks_as_rtstruct
+from LabelmapUtils import labelmap_dtype
+
+from .dicom_conversion import (
+    OUTPUT_DIR,
+    _norm,
+    count_outside_grid,
+    crop_to_bounding_box,
+    load_dicom_series,
+    load_plan_dose,
+    resample_to_reference,
+    save_hedos_inputs,
+    uncrop,
+)
+from .organ_groups import group_masks, resolve_groups
+
+
+NIFTI_EXTENSIONS = (".nii", ".nii.gz")
+
+
+def totalsegmentator_class_map(task: str) -> dict:
+    """Label value -> organ name of a multilabel TotalSegmentator output."""
+    try:
+        from totalsegmentator.map_to_binary import class_map
+    except ImportError:
+        raise ValueError("TotalSegmentator is not installed, pass label_names for multilabel segmentations")
+    return dict(class_map[task])
+
+
+def load_segmentation_labelmap(
+    seg_path: str, reference: sitk.Image, label_names: dict = None, task: str = "total"
+):
+    """
+    Load a segmentation onto a reference grid (CT or dose, nearest neighbour) as a labelmap in the layout
+    of the HEDOS dose (row, column, slice). Returns the labelmap and a dict of label value -> organ name.
+    See read_segmentation_labelmap for seg_path.
+    """
+    labelmap_image, label_names = read_segmentation_labelmap(seg_path, label_names, task)
+    return resample_labelmap(labelmap_image, reference, label_names), label_names
+
+
+def resample_labelmap(labelmap_image: sitk.Image, reference: sitk.Image, label_names: dict) -> np.ndarray:
+    """Resample a labelmap image onto a reference grid, as an array in the layout of the HEDOS dose."""
+    labelmap_image = resample_to_reference(labelmap_image, reference, is_label=True)
+    labelmap = np.transpose(sitk.GetArrayFromImage(labelmap_image), (1, 2, 0))
+    return labelmap.astype(labelmap_dtype(max(label_names, default=0)))
+
+
+def read_segmentation_labelmap(seg_path: str, label_names: dict = None, task: str = "total"):
+    """
+    Read a segmentation as a labelmap image on its own grid, with a dict of label value -> organ name.
+    seg_path is either a directory of binary NIfTI masks named after their organ (TotalSegmentator's default
+    output) or a single multilabel NIfTI file, whose values are named by label_names
+    (by default the TotalSegmentator class map of task).
+    Masks of a directory are combined into one labelmap; later files win where they overlap.
+    """
+    if os.path.isdir(seg_path):
+        files = sorted(f for f in os.listdir(seg_path) if f.endswith(NIFTI_EXTENSIONS))
+        if not files:
+            raise ValueError(f"No NIfTI segmentations found in directory: {seg_path}")
+
+        label_names = {}
+        seg_image = labelmap = None
+        for value, file in enumerate(files, start=1):
+            image = sitk.ReadImage(os.path.join(seg_path, file))
+            if seg_image is None:
+                seg_image = image
+                labelmap = np.zeros(sitk.GetArrayViewFromImage(image).shape, dtype=labelmap_dtype(len(files)))
+            elif image.GetSize() != seg_image.GetSize():
+                raise ValueError(f"Segmentation {file} is not on the grid of {files[0]}")
+            labelmap[sitk.GetArrayViewFromImage(image) > 0] = value
+            label_names[value] = _norm(file[: -len(".nii.gz")] if file.endswith(".nii.gz") else file[: -len(".nii")])
+
+        labelmap_image = sitk.GetImageFromArray(labelmap)
+        labelmap_image.CopyInformation(seg_image)
+    else:
+        labelmap_image = sitk.ReadImage(seg_path)
+        if label_names is None:
+            label_names = totalsegmentator_class_map(task)
+        label_names = {int(value): _norm(name) for value, name in label_names.items()}
+
+    return labelmap_image, label_names
+
+
+def labelmap_conversion(
+    CT_DIR: str,
+    SEGMENTATIONS,
+    RTDOSE_PATH: str,
+    groups: dict = None,
+    RTSTRUCT_PATH: str = None,
+    rtstruct_rois: list = None,
+    output_dir: str = OUTPUT_DIR,
+    seg_format: str = "npy",
+    label_names: dict = None,
+    task: str = "total",
+    rtstruct_output: str = None,
+    n_workers: int = None,
+    grid: str = "ct",
+) -> None:
+    """
+    Convert CT + segmentation labelmaps + RTDOSE to HEDOS NumPy inputs.
+    RTDOSE_PATH: one RTDOSE file or a list of them, which are summed (see dicom_conversion).
+    SEGMENTATIONS: one or a list of segmentations (see load_segmentation_labelmap), e.g. one per TotalSegmentator task.
+    groups: organ groups added as extra structures (GROUPS in examples/organs.py).
+    RTSTRUCT_PATH: optional RTSTRUCT holding structures that are not in the segmentations, e.g. the tumor;
+                   rtstruct_rois selects its ROIs (all by default).
+    rtstruct_output: if given, all structures are also written to this RTSTRUCT file (CT grid only).
+    grid: "ct" or "dose", the grid everything is saved on (see dicom_conversion).
+    """
+    if grid not in ("ct", "dose"):
+        raise ValueError(f"Unknown grid: {grid}")
+    if rtstruct_output is not None and grid != "ct":
+        raise ValueError("An RTSTRUCT can only be written for the CT grid")
+    if isinstance(SEGMENTATIONS, str):
+        SEGMENTATIONS = [SEGMENTATIONS]
+
+    ct_image = load_dicom_series(CT_DIR)
+    dose_image = load_plan_dose(RTDOSE_PATH, ct_image if grid == "ct" else None, output_dir)
+    reference = ct_image if grid == "ct" else dose_image
+
+    labelmaps = []
+    outside_voxels = {}
+    for seg_path in SEGMENTATIONS:
+        labelmap_image, names = read_segmentation_labelmap(seg_path, label_names, task)
+        if grid == "dose":
+            counts = count_outside_grid(labelmap_image, dose_image)
+            for value, name in names.items():
+                outside_voxels[name] = counts[value] if value < len(counts) else 0.0
+        labelmaps.append((resample_labelmap(labelmap_image, reference, names), names))
+
+    # structures are cropped to their bounding box straight from the labelmaps, as (bbox, mask)
+    structure_masks = {}
+    for labelmap, names in labelmaps:
+        bboxes = find_objects(labelmap)
+        for value, name in names.items():
+            if value <= len(bboxes) and bboxes[value - 1] is not None:
+                bbox = bboxes[value - 1]
+                structure_masks[name] = (bbox, labelmap[bbox] == value)
+
+    if groups:
+        for group_name, mask in group_masks(labelmaps, groups).items():
+            structure_masks[_norm(group_name)] = crop_to_bounding_box(mask)
+        if grid == "dose":
+            for group_name, members in resolve_groups(groups).items():
+                outside_voxels[_norm(group_name)] = sum(outside_voxels.get(_norm(m), 0.0) for m in members)
+
+    if RTSTRUCT_PATH is not None:
+        rtstruct = RTStructBuilder.create_from(dicom_series_path=CT_DIR, rt_struct_path=RTSTRUCT_PATH)
+        cropped_masks = rtstruct.get_cropped_roi_masks(rtstruct_rois, n_workers=n_workers)
+        ct_shape = image_helper.get_series_mask_shape(rtstruct.series_data)
+        for roi_name, (bbox, mask) in cropped_masks.items():
+            if bbox is None or not mask.any():
+                continue
+            if grid == "dose":
+                mask_image = sitk.GetImageFromArray(np.transpose(uncrop(bbox, mask, ct_shape), (2, 0, 1)))
+                mask_image.CopyInformation(ct_image)
+                outside_voxels[_norm(roi_name)] = count_outside_grid(mask_image, dose_image)[1:].sum()
+                bbox, mask = crop_to_bounding_box(resample_labelmap(mask_image, dose_image, {1: roi_name}))
+            structure_masks[_norm(roi_name)] = (bbox, mask)
+
+    outside_voxels = {organ: outside_voxels.get(organ, 0.0) for organ in structure_masks} if grid == "dose" else None
+    save_hedos_inputs(
+        reference, structure_masks, dose_image, output_dir,
+        seg_format=seg_format, outside_voxels=outside_voxels,
+    )
+
+    if rtstruct_output is not None:
+        shape = sitk.GetArrayViewFromImage(reference).shape
+        save_masks_as_rtstruct(
+            {name: uncrop(bbox, mask, shape[1:] + shape[:1], bool) for name, (bbox, mask) in structure_masks.items()},
+            CT_DIR, rtstruct_output, n_workers=n_workers,
+        )
+
+    print("[HEDOS] NumPy conversion done")
@@ -1,9 +1,11 @@
-from rt_utils import RTStructBuilder
-import numpy as np
+from rt_utils import RTStructBuilder, image_helper
 import os
 
+from .organ_groups import cropped_group_masks, group_member_names
+
 # Merge an RTSTRUCT and create grouped ROIs based on predefined organ groups
-def merge_rtstruct(rtstruct_path, ct_folder, output_path, groups):
+# (group contours are generated in n_workers processes, see rt_utils.utils.get_n_processes)
+def merge_rtstruct(rtstruct_path, ct_folder, output_path, groups, n_workers=None):
 
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
@@ -13,39 +15,18 @@ def merge_rtstruct(rtstruct_path, ct_folder, output_path, groups):
     )
     rt_dst = RTStructBuilder.create_new(dicom_series_path=ct_folder)
 
-    # Copy original ROIs
-    for name in rt_src.get_roi_names():
-        try:
-            m = rt_src.get_roi_mask_by_name(name)
-            if m is not None:
-                rt_dst.add_roi(mask=m.astype(bool), name=name)
-        except Exception:
-            pass  # skip invalid ROIs
-
-    # Case-insensitive ROI lookup
-    def get_mask_by_name_ci(builder, name):
-        if name in builder.get_roi_names():
-            return builder.get_roi_mask_by_name(name)
-        lname = name.strip().lower()
-        for s in builder.get_roi_names():
-            if s.strip().lower() == lname:
-                return builder.get_roi_mask_by_name(s)
-        return None
-
-    # Build grouped ROIs
-    for group_name, parts in groups.items():
-        masks = []
-        for p in parts:
-            m = get_mask_by_name_ci(rt_dst, p)
-            if m is None:
-                m = get_mask_by_name_ci(rt_src, p)
-            if m is not None:
-                masks.append(m.astype(bool))
-
-        if masks:
-            merged = np.any(np.stack(masks, axis=0), axis=0)
-            if np.any(merged):
-                rt_dst.add_roi(mask=merged, name=group_name)
+    # Copy original ROIs, contours are copied unchanged
+    src_names = rt_src.get_roi_names()
+    for name in src_names:
+        rt_dst.copy_roi_from(rt_src, name)
+
+    # Rasterize only the source ROIs that are part of a group, once, and build the groups from their crops
+    cropped_masks = rt_src.get_cropped_roi_masks(group_member_names(src_names, groups))
+    group_masks = cropped_group_masks(cropped_masks, groups, image_helper.get_series_mask_shape(rt_src.series_data))
+
+    # Each union is contoured once, all groups in parallel
+    if group_masks:
+        rt_dst.add_rois(group_masks, n_workers=n_workers)
 
     rt_dst.save(output_path)
     print("[RTSTRUCT] Grouped saved:", output_path)
@@ -0,0 +1,111 @@
+"""
+Organ grouping at labelmap level.
+
+Groups (group name -> member names, as GROUPS in examples/organs.py) may contain other groups.
+They are resolved to sets of structures in dependency order. For labelmaps, they are turned into
+a lookup table from label value to group bits and applied to each labelmap with one remap;
+for RTSTRUCT ROIs, the group masks are built from the cropped masks of the members only.
+"""
+
+import numpy as np
+
+
+def _normalize(name: str) -> str:
+    return name.strip().lower()
+
+
+def resolve_groups(groups: dict) -> dict:
+    """
+    Resolve nested groups: returns group name -> set of (normalized) member names that are not groups.
+    Groups are resolved in dependency order, so the result does not depend on the order of the dict.
+    Raises ValueError if groups contain each other in a cycle.
+    """
+    group_names = {_normalize(group_name): group_name for group_name in groups}
+    resolved = {}
+    in_progress = set()
+
+    def resolve(key):
+        if key in resolved:
+            return resolved[key]
+        if key in in_progress:
+            raise ValueError(f"Organ group '{group_names[key]}' contains itself")
+        in_progress.add(key)
+        members = set()
+        for part in groups[group_names[key]]:
+            part = _normalize(part)
+            members |= resolve(part) if part in group_names else {part}
+        in_progress.discard(key)
+        resolved[key] = members
+        return members
+
+    return {group_names[key]: resolve(key) for key in group_names}
+
+
+def group_lut(label_names: dict, group_members: list) -> np.ndarray:
+    """
+    Lookup table of shape (ceil(n_groups / 8), max label value + 1): bit g % 8 of row g // 8
+    is set for the label values of the members of group g.
+    """
+    n_values = max(label_names, default=0) + 1
+    lut = np.zeros(((len(group_members) + 7) // 8, n_values), dtype=np.uint8)
+    for g, members in enumerate(group_members):
+        values = [value for value, name in label_names.items() if _normalize(name) in members]
+        lut[g // 8, values] |= np.uint8(1 << (g % 8))
+    return lut
+
+
+def group_masks(labelmaps: list, groups: dict) -> dict:
+    """
+    Masks of organ groups over (labelmap, label value -> name) pairs.
+    Each labelmap is remapped once per 8 groups; groups without any voxel are left out.
+    """
+    resolved = resolve_groups(groups)
+    group_names = list(resolved)
+    members = [resolved[group_name] for group_name in group_names]
+
+    masks = {}
+    for labelmap, label_names in labelmaps:
+        lut = group_lut(label_names, members)
+        for word in range(lut.shape[0]):
+            if not lut[word].any():
+                continue
+            bits = lut[word][labelmap]
+            for g in range(8 * word, min(8 * word + 8, len(group_names))):
+                bit = np.uint8(1 << (g % 8))
+                if not (lut[word] & bit).any():
+                    continue
+                mask = (bits & bit) != 0
+                group_name = group_names[g]
+                masks[group_name] = mask if group_name not in masks else masks[group_name] | mask
+
+    return {
+        group_name: masks[group_name]
+        for group_name in group_names
+        if group_name in masks and masks[group_name].any()
+    }
+
+
+def group_member_names(names, groups: dict) -> list:
+    """The names (e.g. the ROIs of an RTSTRUCT) that are a member of any group, nested groups included."""
+    members = set().union(*resolve_groups(groups).values())
+    return list(dict.fromkeys(name for name in names if _normalize(name) in members))
+
+
+def cropped_group_masks(cropped_masks: dict, groups: dict, shape) -> dict:
+    """
+    Masks of organ groups built from the masks of their members cropped to their bounding box
+    (name -> (bbox, cropped mask), as RTStruct.get_cropped_roi_masks): every member is only written
+    into its bounding box of the groups it belongs to. Groups without any voxel are left out.
+    """
+    masks = {}
+    for group_name, members in resolve_groups(groups).items():
+        mask = None
+        for name, (bbox, cropped_mask) in cropped_masks.items():
+            if bbox is None or _normalize(name) not in members:
+                continue
+            if mask is None:
+                mask = np.zeros(shape, dtype=bool)
+            mask[bbox] |= cropped_mask
+        if mask is not None and mask.any():
+            masks[group_name] = mask
+    return masks
@@ -2,13 +2,17 @@ class Patient_parameters:
     '''
     Patient class includes patient biological data
     '''
-    def __init__(self, gender, tumor_site, tumor_volume_fraction, relative_blood_density, relative_perfusion, organs):
+    def __init__(self, gender, tumor_site, tumor_volume_fraction, relative_blood_density, relative_perfusion, organs,
+                 boxes=None, height=None, weight=None):
         self.gender = gender
         self.tumor_site = tumor_site
         self.tumor_volume_fraction = tumor_volume_fraction
         self.relative_blood_density = relative_blood_density
         self.relative_perfusion = relative_perfusion
         self.organs = organs
+        # additional lesion/nodal boxes: {name: {'tumor_site', 'tumor_volume_fraction',
+        #                                        'relative_blood_density', 'relative_perfusion'}}
+        self.boxes = boxes if boxes is not None else {}
 
         if gender.lower() in ['m', 'male']:
             self.sheet_name = 'male_new'
@@ -22,6 +26,27 @@ class Patient_parameters:
         else:
             raise ValueError('Cannot deduce gender.')
 
+        # patient-specific TBV and CO from height (cm) and weight (kg), if given:
+        self.height = height
+        self.weight = weight
+        if height is not None and weight is not None:
+            self._scale_to_body_size(height, weight)
+
+    def _scale_to_body_size(self, height, weight):
+        '''
+        TBV from Nadler's formula; CO scaled from the reference value by body surface area (Mosteller).
+        The reference values above correspond to the ICRP 89 reference adults.
+        '''
+        height_m = height / 100
+        if self.sheet_name == 'male_new':
+            self.TBV = 0.3669 * height_m ** 3 + 0.03219 * weight + 0.6041
+            reference_bsa = (176 * 73 / 3600) ** 0.5
+        else:
+            self.TBV = 0.3561 * height_m ** 3 + 0.03308 * weight + 0.1833
+            reference_bsa = (163 * 60 / 3600) ** 0.5
+        bsa = (height * weight / 3600) ** 0.5
+        self.CO *= bsa / reference_bsa
+
     def __getitem__(self, key):
         return self.to_dict()[key]
 
@@ -30,7 +55,9 @@ class Patient_parameters:
         print('Sheet Name: {}'.format(self.sheet_name))
         print('Tumor site: {}'.format(self.tumor_site))
         print("Organs: {}".format(self.organs))
+        print("Boxes: {}".format(list(self.boxes.keys())))
         print("Total Blood Count: {}".format(self.relative_blood_density))
+        print("Total Blood Volume: {}".format(self.TBV))
         print("Cardiac Output: {}".format(self.CO))
 
     def to_dict(self):
@@ -42,6 +69,7 @@ class Patient_parameters:
             "relative_blood_density": self.relative_blood_density,
             "relative_perfusion": self.relative_perfusion,
             "organs": self.organs,
+            "boxes": self.boxes,
             "TBV": self.TBV,
             "CO": self.CO
         }
@@ -49,7 +77,7 @@ class Simulation_parameters:
     '''
     Simulation class includes siumation parameters
     '''
-    def __init__(self,sample_size,nr_steps,dt,weibull_shape,generate_new,random_walk,accumulate):
+    def __init__(self,sample_size,nr_steps,dt,weibull_shape,generate_new,random_walk,accumulate,multi_rate=False):
         self.sample_size = sample_size #number of simulation particles
         self.nr_steps = nr_steps #number of time steps
         self.dt = dt #in seconds
@@ -57,6 +85,7 @@ class Simulation_parameters:
         self.generate_new = generate_new
         self.random_walk = random_walk
         self.accumulate = accumulate
+        self.multi_rate = multi_rate #draw exact exit times so that dt is not limited by the fastest compartment
 
     def __getitem__(self, key):
         return self.to_dict()[key]
@@ -69,6 +98,7 @@ class Simulation_parameters:
         print('Generate New: {}'.format(self.generate_new))
         print('Random walk: {}'.format(self.random_walk))
         print('Accumulate: {}'.format(self.accumulate))
+        print('Multi-rate: {}'.format(self.multi_rate))
 
     def to_dict(self):
         return {
@@ -78,19 +108,23 @@ class Simulation_parameters:
             "weibull_shape": self.weibull_shape,
             "generate_new": self.generate_new,
             "random_walk": self.random_walk,
-            "accumulate": self.accumulate
+            "accumulate": self.accumulate,
+            "multi_rate": self.multi_rate
         }
 class Treatment_parameters:
     '''
     Parameters class includes parameters for the treatment
+    beam_names (optional) names the per-beam dose (see Patient.beam_names, e.g. "beam_1") delivered in each field
     '''
-    def __init__(self,nr_fractions,total_beam_on_time,start_times,beam_on_times):
+    def __init__(self,nr_fractions,total_beam_on_time,start_times,beam_on_times,beam_names=None):
         self.nr_fractions = nr_fractions
         self.total_beam_on_time = total_beam_on_time
         self.start_times = start_times
         self.beam_on_times = beam_on_times
+        self.beam_names = beam_names
         assert(sum(beam_on_times) == total_beam_on_time), 'Beam-on-time of separate fields should equal total beam-on-time.'
         assert(start_times[:-1] + beam_on_times[:-1] <= start_times[1:]), 'Cannot start new field before completing current.'
+        assert(beam_names is None or len(beam_names) == len(start_times)), 'Give one beam name per field.'
 
     def __getitem__(self, key):
         return self.to_dict()[key]
@@ -100,7 +134,8 @@ class Treatment_parameters:
         "nr_fractions": self.nr_fractions,
         "total_beam_on_time": self.total_beam_on_time,
         "start_times": self.start_times,
-        "beam_on_times": self.beam_on_times
+        "beam_on_times": self.beam_on_times,
+        "beam_names": self.beam_names
         }
 
     def summary(self):
@@ -108,3 +143,4 @@ class Treatment_parameters:
         print('total_beam_on_time: {}'.format(self.total_beam_on_time))
         print('start_times: {}'.format(self.start_times))
         print('beam_on_times: {}'.format(self.beam_on_times))
+        print('beam_names: {}'.format(self.beam_names))
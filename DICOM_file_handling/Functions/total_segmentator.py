@@ -5,7 +5,8 @@ import multiprocessing as mp
 import os
 
 
-def run_totalseg(CT, RTSTRUCT,task,fast, organs = None,):
+# output_type="nifti" writes one NIfTI mask per organ, for labelmap_conversion (no RTSTRUCT round trip)
+def run_totalseg(CT, RTSTRUCT,task,fast, organs = None, output_type = "dicom"):
     from totalsegmentator.python_api import totalsegmentator
     #organ_text_list = os.path.join(os.path.dirname(os.path.abspath(__file__)), "total_segmentator_organs.txt")
 
@@ -15,7 +16,7 @@ def run_totalseg(CT, RTSTRUCT,task,fast, organs = None,):
         output = RTSTRUCT + "/" + task,
         task = task, # no subtask in this case
         roi_subset=organs if organs else None, #contour selected organs
-        output_type = "dicom", #Use RTSTRUCT as output to input into HEDOS
+        output_type = output_type, #RTSTRUCT ("dicom") or NIfTI masks ("nifti") as input into HEDOS
         fast = fast, #fast algorithm version, less precise
         device = "mps" if torch.backends.mps.is_available() else "cpu" #using mps as GPU instead of CPU for faster simulation
     )
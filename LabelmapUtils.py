@@ -0,0 +1,9 @@
+import numpy as np
+
+
+def labelmap_dtype(n_labels):
+    """
+    Smallest unsigned integer type that can hold the given number of labels (plus background),
+    i.e. label values up to n_labels. Shared by the conversion (DICOM_file_handling) and the simulation.
+    """
+    return np.uint8 if n_labels <= np.iinfo(np.uint8).max else np.uint16
@@ -31,6 +31,11 @@ if __name__ == "__main__":
     CT = "..."
     RTSTRUCT = "..."
 
+    # Plans exported with one RTDOSE per beam: pass them all, they are summed and the per-beam doses
+    # are kept (beam_doses/beams.json lists their names), so that the workflows apply every beam's own dose
+    # rate to the fields named by Treatment_parameters(beam_names=...).
+    # RTDOSE = ["...", "..."]
+
     # Step 2.2: group structures by merging ROIs (masks) inside the RTSTRUCT (GROUPS in organs.py)
     groups = GROUPS
     grouped_rtstruct_location = os.path.join(os.path.dirname(RTSTRUCT), "segmentations_grouped.dcm")
@@ -41,3 +46,17 @@ if __name__ == "__main__":
     # Step 2.3: convert grouped RTSTRUCT + CT + RTDOSE to NumPy
     dicom_conversion(CT, grouped_rtstruct_location, RTDOSE)
     print("[PIPELINE] Step 2: NumPy inputs ready")
+
+    # Alternative to steps 2.2-2.3, when step 1 ran TotalSegmentator with output_type="nifti":
+    # group and convert the segmentation labelmaps directly (no RTSTRUCT round trip); the tumor
+    # is taken from the RTSTRUCT and a grouped RTSTRUCT can still be written as a side output.
+    # from DICOM_file_handling.Functions import labelmap_conversion
+    # SEGMENTATIONS = [f"{RTSTRUCT_LOCATION}/total", f"{RTSTRUCT_LOCATION}/vertebrae_body"]
+    # labelmap_conversion(CT, SEGMENTATIONS, RTDOSE, groups=GROUPS, RTSTRUCT_PATH=RTSTRUCT, rtstruct_rois=["tumor"],
+    #                     rtstruct_output=grouped_rtstruct_location)
+
+    # Many patients/plans at once: list them in a manifest (JSON or CSV with patient, plan, CT, RTSTRUCT or
+    # SEGMENTATIONS, RTDOSE and any conversion options), each is converted to output_root/<patient>/<plan>.
+    # Re-running only converts the entries whose input files or options changed since the last run.
+    # from DICOM_file_handling.Functions import batch_conversion
+    # batch_conversion("cohort_manifest.csv", output_root="../input/patients", n_workers=8)
@@ -62,6 +62,7 @@ if __name__ == "__main__":
         total_beam_on_time=140,
         start_times=[0, 90],
         beam_on_times=[70, 70]
+        # with per-beam doses, name the beam of every field, e.g. beam_names=["beam_1", "beam_2"]
     )
 
     # Step 3.4: run HEDOS multiple times and save outputs
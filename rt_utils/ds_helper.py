@@ -1,3 +1,4 @@
+import copy
 import datetime
 from rt_utils.image_helper import get_contours_coords
 from rt_utils.utils import ROIData, SOPClassUID
@@ -5,12 +6,16 @@ import numpy as np
 from pydicom.uid import generate_uid
 from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
 from pydicom.sequence import Sequence
+from pydicom.dataelem import RawDataElement
+from pydicom.tag import Tag
 from pydicom.uid import ImplicitVRLittleEndian
 
 """
 File contains helper methods that handles DICOM header creation/formatting
 """
 
+CONTOUR_DATA_TAG = 0x30060050
+
 
 def create_rtstruct_dataset(series_data) -> FileDataset:
     ds = generate_base_dataset()
@@ -149,23 +154,25 @@ def create_structure_set_roi(roi_data: ROIData) -> Dataset:
     return structure_set_roi
 
 
-def create_roi_contour(roi_data: ROIData, series_data) -> Dataset:
+def create_roi_contour(roi_data: ROIData, series_data, contours_coords=None) -> Dataset:
     roi_contour = Dataset()
     roi_contour.ROIDisplayColor = roi_data.color
-    roi_contour.ContourSequence = create_contour_sequence(roi_data, series_data)
+    roi_contour.ContourSequence = create_contour_sequence(roi_data, series_data, contours_coords)
     roi_contour.ReferencedROINumber = str(roi_data.number)
     return roi_contour
 
 
-def create_contour_sequence(roi_data: ROIData, series_data) -> Sequence:
+def create_contour_sequence(roi_data: ROIData, series_data, contours_coords=None) -> Sequence:
     """
     Iterate through each slice of the mask
     For each connected segment within a slice, create a contour
+    contours_coords can be passed when they were already computed (see get_contours_coords_parallel)
     """
 
     contour_sequence = Sequence()
 
-    contours_coords = get_contours_coords(roi_data, series_data)
+    if contours_coords is None:
+        contours_coords = get_contours_coords(roi_data, series_data)
 
     for series_slice, slice_contours in zip(series_data, contours_coords):
         for contour_data in slice_contours:
@@ -194,11 +201,25 @@ def create_contour(series_slice: Dataset, contour_data: np.ndarray) -> Dataset:
     )  # Each point has an x, y, and z value
 
     # Rounds ContourData to 10 decimal places to ensure it is <16 bytes length, as per NEMA DICOM standard guidelines.
-    contour.ContourData = [round(val, 10) for val in contour_data]
+    contour[CONTOUR_DATA_TAG] = create_raw_ds_element(
+        CONTOUR_DATA_TAG, np.round(contour_data, 10)
+    )
 
     return contour
 
 
+def create_raw_ds_element(tag, values: np.ndarray) -> RawDataElement:
+    """
+    Creates a decimal string (DS) element from an array of numbers, encoded directly.
+    pydicom only decodes it when it is accessed, instead of validating every value
+    on assignment, which dominates the time spent writing large contours.
+    """
+    value = "\\".join(map(str, np.asarray(values, dtype=float).tolist())).encode("ascii")
+    if len(value) % 2:
+        value += b" "
+    return RawDataElement(Tag(tag), "DS", len(value), value, 0, True, True)
+
+
 def create_rtroi_observation(roi_data: ROIData) -> Dataset:
     rtroi_observation = Dataset()
     rtroi_observation.ObservationNumber = roi_data.number
@@ -222,3 +243,54 @@ def get_contour_sequence_by_roi_number(ds, roi_number):
                 return Sequence()
 
     raise Exception(f"Referenced ROI number '{roi_number}' not found")
+
+
+def get_contour_sequences_by_roi_number(ds) -> dict:
+    """
+    Returns the contour sequence of every ROI, keyed by ROI number (as str)
+    """
+    return {
+        str(roi_contour.ReferencedROINumber): getattr(roi_contour, "ContourSequence", Sequence())
+        for roi_contour in ds.ROIContourSequence
+    }
+
+
+def copy_roi_datasets(ds, roi_number, new_roi_number, frame_of_reference_uid=None, name=None):
+    """
+    Returns copies of the ROI contour, structure set ROI and RT ROI observation of an ROI,
+    renumbered to new_roi_number. Contour data is copied as is.
+    """
+    roi_contour = next(
+        item for item in ds.ROIContourSequence
+        if str(item.ReferencedROINumber) == str(roi_number)
+    )
+    structure_set_roi = next(
+        item for item in ds.StructureSetROISequence
+        if str(item.ROINumber) == str(roi_number)
+    )
+    rtroi_observation = next(
+        (item for item in getattr(ds, "RTROIObservationsSequence", [])
+         if str(item.ReferencedROINumber) == str(roi_number)),
+        None,
+    )
+
+    roi_contour = copy.deepcopy(roi_contour)
+    roi_contour.ReferencedROINumber = str(new_roi_number)
+
+    structure_set_roi = copy.deepcopy(structure_set_roi)
+    structure_set_roi.ROINumber = new_roi_number
+    if frame_of_reference_uid is not None:
+        structure_set_roi.ReferencedFrameOfReferenceUID = frame_of_reference_uid
+    if name is not None:
+        structure_set_roi.ROIName = name
+
+    if rtroi_observation is None:
+        rtroi_observation = Dataset()
+        rtroi_observation.RTROIInterpretedType = ""
+        rtroi_observation.ROIInterpreter = ""
+    else:
+        rtroi_observation = copy.deepcopy(rtroi_observation)
+    rtroi_observation.ObservationNumber = new_roi_number
+    rtroi_observation.ReferencedROINumber = new_roi_number
+
+    return roi_contour, structure_set_roi, rtroi_observation
@@ -1,5 +1,9 @@
 import os
-from typing import List
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional
 from enum import IntEnum
 
 import cv2 as cv
@@ -8,15 +12,17 @@ from pydicom import dcmread
 from pydicom.dataset import Dataset
 from pydicom.sequence import Sequence
 
-from rt_utils.utils import ROIData, SOPClassUID
+from rt_utils.utils import ROIData, SOPClassUID, get_n_processes
 
 
-def load_sorted_image_series(dicom_series_path: str):
+def load_sorted_image_series(
+    dicom_series_path: str, series_instance_uid: Optional[str] = None
+):
     """
     File contains helper methods for loading / formatting DICOM images and contours
     """
 
-    series_data = load_dcm_images_from_path(dicom_series_path)
+    series_data = load_dcm_images_from_path(dicom_series_path, series_instance_uid)
 
     if len(series_data) == 0:
         raise Exception("No DICOM Images found in input path")
@@ -27,55 +33,218 @@ def load_sorted_image_series(dicom_series_path: str):
     return series_data
 
 
-def load_dcm_images_from_path(dicom_series_path: str) -> List[Dataset]:
-    series_data = []
-    for root, _, files in os.walk(dicom_series_path):
-        for file in files:
-            try:
-                ds = dcmread(os.path.join(root, file))
-                if hasattr(ds, "pixel_array"):
-                    series_data.append(ds)
+# Headers of the image series read most recently, shared by all RTStruct builders
+# and conversion steps of the process: abspath -> (fingerprint, {series uid: headers}).
+# Least recently used directories are evicted beyond SERIES_CACHE_SIZE, so long-running
+# processes (e.g. batch conversion workers) do not keep every series they have seen.
+SERIES_CACHE_SIZE = 4
+_SERIES_CACHE = OrderedDict()
 
-            except Exception:
-                # Not a valid DICOM file
-                continue
 
-    return series_data
+def load_dcm_images_from_path(
+    dicom_series_path: str,
+    series_instance_uid: Optional[str] = None,
+    n_workers: Optional[int] = None,
+) -> List[Dataset]:
+    """
+    Reads the headers of every image slice below dicom_series_path.
+    Pixel data is not read; use load_series_pixel_data when it is needed.
+    Only one series is returned: the one matching series_instance_uid, or
+    the largest series in the directory if it is not given or not found.
+    Headers of the last SERIES_CACHE_SIZE directories are cached until any of their files changes; the
+    returned datasets are shared between callers and must not be modified.
+    """
+    series = load_series_headers(dicom_series_path, n_workers)
+
+    if series_instance_uid in series:
+        return list(series[series_instance_uid])
+
+    if len(series) == 0:
+        return []
+
+    if series_instance_uid is not None:
+        warnings.warn(
+            f"Series {series_instance_uid} not found in {dicom_series_path}"
+        )
+
+    series_uid = max(series, key=lambda uid: len(series[uid]))
+    if len(series) > 1:
+        warnings.warn(
+            f"Found {len(series)} image series in {dicom_series_path}, "
+            f"using the largest ({series_uid}, {len(series[series_uid])} slices)"
+        )
+    return list(series[series_uid])
+
+
+def load_series_headers(dicom_series_path: str, n_workers: Optional[int] = None) -> dict:
+    """
+    Returns the image slice headers below dicom_series_path, grouped by SeriesInstanceUID
+    """
+    key = os.path.abspath(dicom_series_path)
+    paths = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(key)
+        for file in files
+    )
+    fingerprint = []
+    for path in paths:
+        stat = os.stat(path)
+        fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    fingerprint = tuple(fingerprint)
+
+    cached = _SERIES_CACHE.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        _SERIES_CACHE.move_to_end(key)
+        return cached[1]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        headers = executor.map(read_image_header, paths)
+        series = {}
+        for ds in headers:
+            if ds is not None:
+                series.setdefault(ds.SeriesInstanceUID, []).append(ds)
+
+    _SERIES_CACHE[key] = (fingerprint, series)
+    _SERIES_CACHE.move_to_end(key)
+    while len(_SERIES_CACHE) > SERIES_CACHE_SIZE:
+        _SERIES_CACHE.popitem(last=False)
+    return series
+
+
+def clear_series_cache():
+    _SERIES_CACHE.clear()
+
+
+def read_image_header(path: str) -> Optional[Dataset]:
+    """
+    Returns the header of an image slice, or None if path is not an image slice
+    """
+    try:
+        ds = dcmread(path, stop_before_pixels=True)
+    except Exception:
+        # Not a valid DICOM file
+        return None
+
+    if getattr(ds, "SOPClassUID", None) not in SOPClassUID.IMAGE_STORAGE:
+        return None
+    return ds
+
+
+def load_series_pixel_data(series_data, n_workers: Optional[int] = None) -> np.ndarray:
+    """
+    Reads the pixel data of a header-only series, returns a (Rows, Columns, slices) array
+    """
+
+    def read_pixels(series_slice: Dataset):
+        return dcmread(series_slice.filename).pixel_array
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        slices = list(executor.map(read_pixels, series_data))
+    return np.stack(slices, axis=-1)
 
 
 def get_contours_coords(roi_data: ROIData, series_data):
     transformation_matrix = get_pixel_to_patient_transformation_matrix(series_data)
+    return get_mask_contours_coords(
+        roi_data.mask,
+        transformation_matrix,
+        roi_data.use_pin_hole,
+        roi_data.approximate_contours,
+    )
+
+
+def get_contours_coords_parallel(roi_datas: List[ROIData], series_data, n_workers: Optional[int] = None):
+    """
+    get_contours_coords for several ROIs, computed in a pool of n_workers processes
+    (see utils.get_n_processes). Every mask is sent cropped to its bounding box (plus one pixel of background),
+    and the crop offset is added back to the contour points.
+    """
+    transformation_matrix = get_pixel_to_patient_transformation_matrix(series_data)
+    n_slices = len(series_data)
+
+    crops = [crop_mask_for_contours(roi_data.mask) for roi_data in roi_datas]
+    tasks = [(roi_data, crop) for roi_data, crop in zip(roi_datas, crops) if crop is not None]
+
+    args = (
+        [crop[0] for _, crop in tasks],
+        [transformation_matrix] * len(tasks),
+        [roi_data.use_pin_hole for roi_data, _ in tasks],
+        [roi_data.approximate_contours for roi_data, _ in tasks],
+        [crop[1] for _, crop in tasks],
+    )
+    n_processes = get_n_processes(n_workers)
+    if n_processes > 1:
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            results = iter(list(executor.map(get_mask_contours_coords, *args)))
+    else:
+        results = map(get_mask_contours_coords, *args)
 
     series_contours = []
-    for i, series_slice in enumerate(series_data):
-        mask_slice = roi_data.mask[:, :, i]
+    for crop in crops:
+        if crop is None:
+            series_contours.append([[] for _ in range(n_slices)])
+            continue
+        contours = next(results)
+        z0 = crop[1][2]
+        series_contours.append(
+            [[] for _ in range(z0)] + contours + [[] for _ in range(n_slices - z0 - len(contours))]
+        )
+    return series_contours
+
+
+def crop_mask_for_contours(mask: np.ndarray):
+    """
+    Crops a mask to its contoured slices and bounding box, plus one pixel of background.
+    Returns the cropped mask and the (x, y, z) pixel offset of the crop, or None for an empty mask.
+    """
+    slices = np.flatnonzero(mask.any(axis=(0, 1)))
+    if len(slices) == 0:
+        return None
+    z0, z1 = slices[0], slices[-1] + 1
+    rows = np.flatnonzero(mask[:, :, z0:z1].any(axis=(1, 2)))
+    columns = np.flatnonzero(mask[:, :, z0:z1].any(axis=(0, 2)))
+    y0, y1 = max(rows[0] - 1, 0), min(rows[-1] + 2, mask.shape[0])
+    x0, x1 = max(columns[0] - 1, 0), min(columns[-1] + 2, mask.shape[1])
+    return mask[y0:y1, x0:x1, z0:z1], (int(x0), int(y0), int(z0))
+
+
+def get_mask_contours_coords(
+    mask: np.ndarray,
+    transformation_matrix: np.ndarray,
+    use_pin_hole: bool = False,
+    approximate_contours: bool = True,
+    offset=(0, 0, 0),
+):
+    """
+    Returns, per slice of the mask, the contours of the mask in patient coordinates,
+    as flat (x, y, z, x, y, z, ...) arrays. offset is the (x, y, z) pixel offset of the mask in the series.
+    """
+    series_contours = []
+    for i in range(mask.shape[2]):
+        mask_slice = mask[:, :, i]
 
         # Do not add ROI's for blank slices
-        if np.sum(mask_slice) == 0:
+        if not mask_slice.any():
             series_contours.append([])
             continue
 
         # Create pin hole mask if specified
-        if roi_data.use_pin_hole:
-            mask_slice = create_pin_hole_mask(mask_slice, roi_data.approximate_contours)
+        if use_pin_hole:
+            mask_slice = create_pin_hole_mask(mask_slice, approximate_contours)
 
         # Get contours from mask
-        contours, _ = find_mask_contours(mask_slice, roi_data.approximate_contours)
+        contours, _ = find_mask_contours(mask_slice, approximate_contours)
         validate_contours(contours)
 
-        # Format for DICOM
-        formatted_contours = []
-        for contour in contours:
-            # Add z index
-            contour = np.concatenate(
-                (np.array(contour), np.full((len(contour), 1), i)), axis=1
-            )
-
-            transformed_contour = apply_transformation_to_3d_points(
-                contour, transformation_matrix
-            )
-            dicom_formatted_contour = np.ravel(transformed_contour).tolist()
-            formatted_contours.append(dicom_formatted_contour)
+        # Format for DICOM: add z index and transform all contours of the slice at once
+        points = np.concatenate(contours)
+        points = np.concatenate((points, np.full((len(points), 1), i)), axis=1) + offset
+        transformed_points = apply_transformation_to_3d_points(points, transformation_matrix)
+        split_indices = np.cumsum([len(contour) for contour in contours])[:-1]
+        formatted_contours = [
+            np.ravel(transformed_contour)
+            for transformed_contour in np.split(transformed_points, split_indices)
+        ]
 
         series_contours.append(formatted_contours)
 
@@ -90,11 +259,8 @@ def find_mask_contours(mask: np.ndarray, approximate_contours: bool):
         mask.astype(np.uint8), cv.RETR_TREE, approximation_method
     )
     # Format extra array out of data
-    contours = list(
-        contours
-    )  # Open-CV updated contours to be a tuple so we convert it back into a list here
-    for i, contour in enumerate(contours):
-        contours[i] = [[pos[0][0], pos[0][1]] for pos in contour]
+    # Open-CV contours are (N, 1, 2) arrays, keep them as (N, 2) arrays of (x, y) points
+    contours = [contour.reshape(-1, 2) for contour in contours]
     hierarchy = hierarchy[0]  # Format extra array out of data
 
     return contours, hierarchy
@@ -104,41 +270,37 @@ def create_pin_hole_mask(mask: np.ndarray, approximate_contours: bool):
     """
     Creates masks with pin holes added to contour regions with holes.
     This is done so that a given region can be represented by a single contour.
+    From the first point of every child contour, a 2 pixel wide line is cut upwards
+    up to the nearest background pixel above it; all cuts are applied at once.
     """
 
     contours, hierarchy = find_mask_contours(mask, approximate_contours)
-    pin_hole_mask = mask.copy()
-
-    # Iterate through the hierarchy, for child nodes, draw a line upwards from the first point
-    for i, array in enumerate(hierarchy):
-        parent_contour_index = array[Hierarchy.parent_node]
-        if parent_contour_index == -1:
-            continue  # Contour is not a child
-
-        child_contour = contours[i]
-
-        line_start = tuple(child_contour[0])
-
-        pin_hole_mask = draw_line_upwards_from_point(
-            pin_hole_mask, line_start, fill_value=0
-        )
-    return pin_hole_mask
-
-
-def draw_line_upwards_from_point(
-    mask: np.ndarray, start, fill_value: int
-) -> np.ndarray:
+    pin_hole_mask = mask.astype(bool)
+
+    # First points (x, y) of the child nodes
+    starts = np.array([
+        contours[i][0]
+        for i, array in enumerate(hierarchy)
+        if array[Hierarchy.parent_node] != -1
+    ]).reshape(-1, 2)
+    if len(starts) == 0:
+        return pin_hole_mask
+    x, y = starts[:, 0], starts[:, 1]
+
+    # Per column, the last background row at or above each row (-1 if there is none)
+    rows = np.arange(mask.shape[0])[:, np.newaxis]
+    last_background = np.maximum.accumulate(np.where(pin_hole_mask, -1, rows), axis=0)
+    top = last_background[y, x] + 1
+
+    # Cut rows top..y of columns x and x + 1, with a cumulative sum over row start/end markers
     line_width = 2
-    end = (start[0], start[1] - 1)
-    mask = mask.astype(np.uint8)  # Type that OpenCV expects
-    # Draw one point at a time until we hit a point that already has the desired value
-    while mask[end] != fill_value:
-        cv.line(mask, start, end, fill_value, line_width)
-
-        # Update start and end to the next positions
-        start = end
-        end = (start[0], start[1] - line_width)
-    return mask.astype(bool)
+    cuts = np.zeros((mask.shape[0] + 1, mask.shape[1] + line_width), dtype=np.int32)
+    for dx in range(line_width):
+        np.add.at(cuts, (top, x + dx), 1)
+        np.add.at(cuts, (y + 1, x + dx), -1)
+    cuts = np.cumsum(cuts, axis=0)[:-1, :mask.shape[1]] > 0
+    pin_hole_mask[cuts] = False
+    return pin_hole_mask
 
 
 def validate_contours(contours: list):
@@ -239,17 +401,53 @@ def get_spacing_between_slices(series_data):
 def create_series_mask_from_contour_sequence(series_data, contour_sequence: Sequence):
     mask = create_empty_series_mask(series_data)
     transformation_matrix = get_patient_to_pixel_transformation_matrix(series_data)
+    contour_index = index_contour_sequence(series_data, contour_sequence)
 
-    # Iterate through each slice of the series, If it is a part of the contour, add the contour mask
-    for i, series_slice in enumerate(series_data):
-        slice_contour_data = get_slice_contour_data(series_slice, contour_sequence)
-        if len(slice_contour_data):
-            mask[:, :, i] = get_slice_mask_from_slice_contour_data(
-                series_slice, slice_contour_data, transformation_matrix
-            )
+    # Only rasterize the slices that are part of the contour
+    for i, slice_contour_data in contour_index.items():
+        mask[:, :, i] = get_slice_mask_from_slice_contour_data(
+            series_data[i], slice_contour_data, transformation_matrix
+        )
     return mask
 
 
+def index_contour_sequence(series_data, contour_sequence: Sequence) -> dict:
+    """
+    Groups the contour data of a sequence by slice index, in a single pass over the contours.
+    Contours are matched to slices by ReferencedSOPInstanceUID, or by the position of
+    their first point along the slice normal when they have no (known) reference.
+    """
+    slice_indices = {
+        series_slice.SOPInstanceUID: i for i, series_slice in enumerate(series_data)
+    }
+
+    contour_index = {}
+    unreferenced = []
+    for contour in contour_sequence:
+        if "ContourData" not in contour:
+            continue
+        found = False
+        for contour_image in getattr(contour, "ContourImageSequence", []):
+            i = slice_indices.get(contour_image.ReferencedSOPInstanceUID)
+            if i is not None:
+                contour_index.setdefault(i, []).append(contour.ContourData)
+                found = True
+        if not found:
+            unreferenced.append(contour.ContourData)
+
+    if unreferenced:
+        _, _, slice_direction = get_slice_directions(series_data[0])
+        slice_positions = np.array([get_slice_position(s) for s in series_data])
+        tolerance = abs(get_spacing_between_slices(series_data)) / 2
+        for contour_data in unreferenced:
+            position = np.dot(slice_direction, [float(v) for v in contour_data[:3]])
+            i = int(np.argmin(np.abs(slice_positions - position)))
+            if abs(slice_positions[i] - position) <= tolerance:
+                contour_index.setdefault(i, []).append(contour_data)
+
+    return contour_index
+
+
 def get_slice_contour_data(series_slice: Dataset, contour_sequence: Sequence):
     slice_contour_data = []
 
@@ -264,44 +462,296 @@ def get_slice_contour_data(series_slice: Dataset, contour_sequence: Sequence):
 def get_slice_mask_from_slice_contour_data(
     series_slice: Dataset, slice_contour_data, transformation_matrix: np.ndarray
 ):
+    polygons = get_slice_polygons(slice_contour_data, transformation_matrix)
+    slice_mask = create_empty_slice_mask(series_slice).astype(np.uint8)
+    fill_polygons(slice_mask, polygons, 1)
+    return slice_mask
+
+
+def fill_polygons(mask: np.ndarray, polygons, value, offset=(0, 0)):
+    """
+    Fills every polygon separately, so that nested and overlapping contours combine as a union
+    (a single cv.fillPoly call would apply the even-odd rule and turn them into holes).
+    """
+    for polygon in polygons:
+        cv.fillPoly(mask, [polygon], value, offset=offset)
+
+
+def get_slice_polygons(slice_contour_data, transformation_matrix: np.ndarray):
+    return [
+        np.round(points).astype(np.int32)
+        for points in get_slice_polygon_points(slice_contour_data, transformation_matrix)
+    ]
+
+
+def get_slice_polygon_points(slice_contour_data, transformation_matrix: np.ndarray):
+    """
+    Returns the contours of a slice as (N, 2) float arrays of (x, y) pixel coordinates
+    """
     polygons = []
     for contour_coords in slice_contour_data:
         pts3 = np.reshape(contour_coords, (len(contour_coords)//3, 3))
         pts3 = apply_transformation_to_3d_points(pts3, transformation_matrix)
-        
+
         ####################################################################
         # MODIFIED SECTION — contour points → filled polygon mask
         ####################################################################
-        
-        poly = np.round(pts3[:, :2]).astype(np.int32)
-        polygons.append(poly)
-
-    slice_mask = create_empty_slice_mask(series_slice).astype(np.uint8)
 
-    for i, p in enumerate(polygons):
-        if p is None or len(p) < 3:
+        if len(pts3) < 3:
             print(f"[!] Collapsed polygon — skipped")
             continue
-        cv.fillPoly(slice_mask, [p], 1)
-        
+        polygons.append(pts3[:, :2])
+
         ####################################################################
         # END MODIFIED SECTION
         ####################################################################
-    return slice_mask
+    return polygons
 
 
+def create_series_masks_from_contour_sequences(
+    series_data, contour_sequences, n_workers: Optional[int] = None
+):
+    """
+    Rasterizes several ROIs in one pass over the slices.
+    Returns, per contour sequence, the bounding box of the ROI in the series mask
+    (a tuple of slices) and the mask cropped to it, or (None, None) for an empty ROI.
+    With more than one worker (see utils.get_n_processes), slabs of slices are rasterized
+    by a pool of processes (see fill_cropped_masks_parallel).
+    """
+    transformation_matrix = get_patient_to_pixel_transformation_matrix(series_data)
+    mask_dims = get_series_mask_shape(series_data)[:2]
+    contour_indices = [
+        index_contour_sequence(series_data, contour_sequence)
+        for contour_sequence in contour_sequences
+    ]
+
+    # Transform all contours to pixel polygons, slice by slice
+    roi_polygons = [{} for _ in contour_sequences]
+    for i in range(len(series_data)):
+        for polygons, contour_index in zip(roi_polygons, contour_indices):
+            if i in contour_index:
+                slice_polygons = get_slice_polygons(contour_index[i], transformation_matrix)
+                if slice_polygons:
+                    polygons[i] = slice_polygons
+
+    bboxes = []
+    for polygons in roi_polygons:
+        if not polygons:
+            bboxes.append(None)
+            continue
+        points = np.concatenate([p for slice_polygons in polygons.values() for p in slice_polygons])
+        x0, y0 = np.clip(points.min(axis=0), 0, None)
+        x1, y1 = points.max(axis=0) + 1
+        y1, x1 = min(y1, mask_dims[0]), min(x1, mask_dims[1])
+        z0, z1 = min(polygons), max(polygons) + 1
+        if x0 >= x1 or y0 >= y1:
+            bboxes.append(None)
+            continue
+        bboxes.append((slice(int(y0), int(y1)), slice(int(x0), int(x1)), slice(z0, z1)))
+
+    n_processes = get_n_processes(n_workers)
+    if n_processes > 1:
+        return fill_cropped_masks_parallel(
+            roi_polygons, bboxes, mask_dims + (len(series_data),), n_processes
+        )
+
+    cropped_masks = []
+    for polygons, bbox in zip(roi_polygons, bboxes):
+        if bbox is None:
+            cropped_masks.append((None, None))
+            continue
+        y, x, z = bbox
 
+        # Slice-major, so that every slice is contiguous for OpenCV
+        mask = np.zeros((z.stop - z.start, y.stop - y.start, x.stop - x.start), dtype=np.uint8)
+        for i, slice_polygons in polygons.items():
+            fill_polygons(mask[i - z.start], slice_polygons, 1, offset=(-x.start, -y.start))
+        cropped_masks.append((bbox, mask.astype(bool).transpose(1, 2, 0)))
+
+    return cropped_masks
+
+
+def create_series_fractions_from_contour_sequences(
+    series_data, contour_sequences, supersampling: int = 4
+):
+    """
+    Rasterizes ROIs as partial-volume fractions: the part of every pixel covered by the contours,
+    sampled at supersampling x supersampling points per pixel (see fill_polygon_fractions).
+    Returns, per contour sequence, the bounding box of the ROI in the series mask and the
+    float32 fractions cropped to it, or (None, None) for an empty ROI.
+    """
+    transformation_matrix = get_patient_to_pixel_transformation_matrix(series_data)
+    mask_dims = get_series_mask_shape(series_data)[:2]
+
+    cropped_fractions = []
+    for contour_sequence in contour_sequences:
+        contour_index = index_contour_sequence(series_data, contour_sequence)
+        polygons = {}
+        for i in sorted(contour_index):
+            slice_polygons = get_slice_polygon_points(contour_index[i], transformation_matrix)
+            if slice_polygons:
+                polygons[i] = slice_polygons
+        if not polygons:
+            cropped_fractions.append((None, None))
+            continue
+
+        # Pixel i covers [i - 0.5, i + 0.5)
+        points = np.concatenate([p for slice_polygons in polygons.values() for p in slice_polygons])
+        x0, y0 = np.clip(np.floor(points.min(axis=0) + 0.5).astype(int), 0, None)
+        x1, y1 = np.floor(points.max(axis=0) + 0.5).astype(int) + 1
+        y1, x1 = min(y1, mask_dims[0]), min(x1, mask_dims[1])
+        z0, z1 = min(polygons), max(polygons) + 1
+        if x0 >= x1 or y0 >= y1:
+            cropped_fractions.append((None, None))
+            continue
+
+        fractions = np.zeros((z1 - z0, y1 - y0, x1 - x0), dtype=np.float32)
+        for i, slice_polygons in polygons.items():
+            fractions[i - z0] = fill_polygon_fractions(
+                [p - (x0, y0) for p in slice_polygons], fractions.shape[1:], supersampling
+            )
+
+        bbox = (slice(int(y0), int(y1)), slice(int(x0), int(x1)), slice(z0, z1))
+        cropped_fractions.append((bbox, fractions.transpose(1, 2, 0)))
+
+    return cropped_fractions
+
+
+def fill_polygon_fractions(polygons, shape, supersampling: int = 4) -> np.ndarray:
+    """
+    Fraction of every pixel of a (rows, columns) slice inside the polygons ((N, 2) arrays of (x, y)
+    pixel coordinates, combined as a union as in fill_polygons), from a scanline fill of a grid
+    supersampled supersampling times in x and y: a sample counts if its centre is inside any polygon.
+    Unlike cv.fillPoly, edges are not drawn, so the area of small structures is not inflated.
+    """
+    n = supersampling
+    height, width = shape[0] * n, shape[1] * n
+
+    # Sample j of pixel 0 is centred at (j + 0.5) / n - 0.5
+    starts = np.concatenate([(np.asarray(p, dtype=np.float64) + 0.5) * n - 0.5 for p in polygons])
+    ends = np.concatenate([
+        np.roll((np.asarray(p, dtype=np.float64) + 0.5) * n - 0.5, -1, axis=0) for p in polygons
+    ])
+    (xa, ya), (xb, yb) = starts.T, ends.T
+    edge_polygon = np.repeat(np.arange(len(polygons)), [len(p) for p in polygons])
+
+    # Sample rows crossed by every edge: centres in [min(y), max(y))
+    first_row = np.ceil(np.minimum(ya, yb)).astype(np.int64)
+    n_rows = np.ceil(np.maximum(ya, yb)).astype(np.int64) - first_row
+    edge = np.repeat(np.arange(len(starts)), n_rows)
+    rows = first_row[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    xs = xa[edge] + (rows - ya[edge]) * (xb[edge] - xa[edge]) / (yb[edge] - ya[edge])
+
+    # Every row crosses the edges of a polygon an even number of times: fill between pairs of crossings
+    # of the same polygon, then take the union of the polygons
+    order = np.lexsort((xs, rows, edge_polygon[edge]))
+    rows, xs = rows[order][::2], xs[order].reshape(-1, 2)
+    keep = (rows >= 0) & (rows < height)
+    rows = rows[keep]
+    columns = np.clip(np.ceil(xs[keep]).astype(np.int64), 0, width)
+
+    samples = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(samples, (rows, columns[:, 0]), 1)
+    np.add.at(samples, (rows, columns[:, 1]), -1)
+    samples = np.cumsum(samples, axis=1)[:, :width] > 0
+    return (samples.reshape(shape[0], n, shape[1], n).sum(axis=(1, 3)) / n**2).astype(np.float32)
+
+
+def fill_cropped_masks_parallel(roi_polygons, bboxes, mask_shape, n_workers: int):
+    """
+    Rasterizes pixel polygons (per ROI: slice index -> polygons) with a pool of processes.
+    The workers write into one preallocated shared-memory buffer holding the mask of every ROI
+    cropped to its bounding box (slice-major, one byte per voxel), so it is no larger than the
+    masks that are returned. Every worker owns a slab of slices, so no two workers write to the same bytes.
+    Returns (bbox, cropped mask) per ROI, as create_series_masks_from_contour_sequences.
+    """
+    # Layout of the buffer: per ROI, the offset and the (slices, rows, columns) shape of its crop
+    layout = []
+    size = 0
+    for bbox in bboxes:
+        if bbox is None:
+            layout.append(None)
+            continue
+        y, x, z = bbox
+        crop_shape = (z.stop - z.start, y.stop - y.start, x.stop - x.start)
+        layout.append((size, crop_shape, (x.start, y.start, z.start)))
+        size += int(np.prod(crop_shape))
+
+    # Split the contoured slices into slabs holding about the same number of polygon points
+    slice_points = np.zeros(mask_shape[2])
+    for polygons in roi_polygons:
+        for i, slice_polygons in polygons.items():
+            slice_points[i] += sum(len(p) for p in slice_polygons)
+    contoured = np.flatnonzero(slice_points)
+    n_slabs = min(4 * n_workers, len(contoured))
+    slabs = []
+    if n_slabs > 0:
+        cumulative = np.cumsum(slice_points[contoured])
+        slab_ids = np.minimum((cumulative - 1) * n_slabs // cumulative[-1], n_slabs - 1).astype(int)
+        for slab_id in range(n_slabs):
+            slab_slices = set(contoured[slab_ids == slab_id].tolist())
+            if not slab_slices:
+                continue
+            slabs.append([
+                (i, layout[k], polygons[i])
+                for i in sorted(slab_slices)
+                for k, polygons in enumerate(roi_polygons)
+                if i in polygons and layout[k] is not None
+            ])
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        buffer = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+        buffer[:] = 0
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for _ in executor.map(_fill_cropped_slab, [shm.name] * len(slabs), [size] * len(slabs), slabs):
+                pass
+
+        cropped_masks = []
+        for bbox, roi_layout in zip(bboxes, layout):
+            if roi_layout is None:
+                cropped_masks.append((None, None))
+                continue
+            offset, crop_shape, _ = roi_layout
+            mask = buffer[offset:offset + int(np.prod(crop_shape))].reshape(crop_shape).astype(bool)
+            cropped_masks.append((bbox, mask.transpose(1, 2, 0)))
+        del buffer
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return cropped_masks
+
+
+def _fill_cropped_slab(shm_name: str, size: int, tasks):
+    """
+    Worker of fill_cropped_masks_parallel: fills the polygons of (slice index, ROI layout, polygons)
+    tasks into the cropped masks in the shared buffer.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        buffer = np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+        for i, (offset, crop_shape, (x0, y0, z0)), polygons in tasks:
+            slice_mask = buffer[offset:offset + int(np.prod(crop_shape))].reshape(crop_shape)[i - z0]
+            fill_polygons(slice_mask, polygons, 1, offset=(-x0, -y0))
+            del slice_mask
+        del buffer
+    finally:
+        shm.close()
 
 
 def create_empty_series_mask(series_data):
+    mask = np.zeros(get_series_mask_shape(series_data), dtype=bool)
+    return mask
+
+
+def get_series_mask_shape(series_data):
     ref_dicom_image = series_data[0]
-    mask_dims = (
+    return (
         int(ref_dicom_image.Columns),
         int(ref_dicom_image.Rows),
         len(series_data),
     )
-    mask = np.zeros(mask_dims).astype(bool)
-    return mask
 
 
 def create_empty_slice_mask(series_slice):
@@ -1,9 +1,19 @@
+import os
 import SimpleITK as sitk
 from SimpleITK import GetArrayFromImage, sitkNearestNeighbor, Image
 import numpy as np
-from torch import nn
 from rt_utils import RTStructBuilder
 
+
+def save_masks_as_rtstruct(masks: dict, dicom_path: str, output_path: str, n_workers: int = None):
+    """
+    Write masks (name -> 3D array, as rt_utils masks of the DICOM series) to a new RT Struct.
+    Contours are generated in n_workers processes (see rt_utils.utils.get_n_processes).
+    """
+    rtstruct = RTStructBuilder.create_new(dicom_series_path=dicom_path)
+    rtstruct.add_rois({name: mask.astype(bool) for name, mask in masks.items()}, n_workers=n_workers)
+    rtstruct.save(output_path)
+
 def debug_output(seg: sitk.Image, seg_path: str, uid:str, dicom_path: str):
     mask_from_sitkImage_zyx = np.transpose(sitk.GetArrayFromImage(seg), (2, 1, 0))
     mask_from_sitkImage_xzy = np.transpose(mask_from_sitkImage_zyx, axes=(2, 0, 1))
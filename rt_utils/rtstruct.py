@@ -1,4 +1,4 @@
-from typing import List, Union
+from typing import Dict, List, Union
 import numpy as np
 from pydicom.dataset import FileDataset
 from rt_utils.utils import ROIData
@@ -16,6 +16,8 @@ class RTStruct:
         self.frame_of_reference_uid = ds.ReferencedFrameOfReferenceSequence[
             -1
         ].FrameOfReferenceUID  # Use last structured set ROI
+        # Rasterized ROIs, cropped to their bounding box: ROI number -> (bbox, mask)
+        self.mask_cache = {}
 
     def set_series_description(self, description: str):
         """
@@ -101,6 +103,82 @@ class RTStruct:
             ds_helper.create_rtroi_observation(roi_data)
         )
 
+    def add_rois(
+        self,
+        masks: Dict[str, np.ndarray],
+        colors: Dict[str, Union[str, List[int]]] = None,
+        description: str = "",
+        use_pin_hole: bool = False,
+        approximate_contours: bool = True,
+        roi_generation_algorithm: Union[str, int] = 0,
+        n_workers: int = None,
+    ):
+        """
+        Add several ROIs at once, given a dict of ROI name -> 3D binary mask.
+        The contours of all ROIs are generated in n_workers processes (see utils.get_n_processes),
+        then added in the order of masks. The other arguments are as for add_roi; colors is an optional
+        dict of ROI name -> color.
+        """
+        colors = colors or {}
+        roi_datas = []
+        for i, (name, mask) in enumerate(masks.items()):
+            self.validate_mask(mask)
+            roi_datas.append(ROIData(
+                mask,
+                colors.get(name),
+                len(self.ds.StructureSetROISequence) + 1 + i,
+                name,
+                self.frame_of_reference_uid,
+                description,
+                use_pin_hole,
+                approximate_contours,
+                roi_generation_algorithm,
+            ))
+
+        contours_coords = image_helper.get_contours_coords_parallel(roi_datas, self.series_data, n_workers)
+
+        for roi_data, roi_contours_coords in zip(roi_datas, contours_coords):
+            self.ds.ROIContourSequence.append(
+                ds_helper.create_roi_contour(roi_data, self.series_data, roi_contours_coords)
+            )
+            self.ds.StructureSetROISequence.append(
+                ds_helper.create_structure_set_roi(roi_data)
+            )
+            self.ds.RTROIObservationsSequence.append(
+                ds_helper.create_rtroi_observation(roi_data)
+            )
+
+    def copy_roi_from(self, other: "RTStruct", name: str, new_name: str = None, roi_number=None):
+        """
+        Copy the ROI with the given name from another RTStruct of the same image series.
+        Contours are copied as they are (only the ROI number changes), so no rasterization
+        or contour extraction takes place. A cached mask of the ROI is copied along.
+        roi_number selects the ROI in the other RTStruct when several ROIs share a name.
+        """
+        if roi_number is None:
+            roi_numbers = {
+                structure_roi.ROIName: structure_roi.ROINumber
+                for structure_roi in reversed(other.ds.StructureSetROISequence)
+            }
+            if name not in roi_numbers:
+                raise RTStruct.ROIException(f"ROI of name `{name}` does not exist in RTStruct")
+            roi_number = roi_numbers[name]
+
+        # Number after the existing ROIs, which need not be numbered 1..n
+        new_roi_number = 1 + max(
+            [len(self.ds.StructureSetROISequence)]
+            + [int(structure_roi.ROINumber) for structure_roi in self.ds.StructureSetROISequence]
+        )
+        roi_contour, structure_set_roi, rtroi_observation = ds_helper.copy_roi_datasets(
+            other.ds, roi_number, new_roi_number, self.frame_of_reference_uid, new_name
+        )
+        self.ds.ROIContourSequence.append(roi_contour)
+        self.ds.StructureSetROISequence.append(structure_set_roi)
+        self.ds.RTROIObservationsSequence.append(rtroi_observation)
+
+        if str(roi_number) in other.mask_cache:
+            self.mask_cache[str(new_roi_number)] = other.mask_cache[str(roi_number)]
+
     def validate_mask(self, mask: np.ndarray) -> bool:
         if mask.dtype != bool:
             raise RTStruct.ROIException(
@@ -138,16 +216,112 @@ class RTStruct:
         Returns the 3D binary mask of the ROI with the given input name
         """
 
-        for structure_roi in self.ds.StructureSetROISequence:
-            if structure_roi.ROIName == name:
-                contour_sequence = ds_helper.get_contour_sequence_by_roi_number(
-                    self.ds, structure_roi.ROINumber
-                )
-                return image_helper.create_series_mask_from_contour_sequence(
-                    self.series_data, contour_sequence
-                )
+        return self.get_roi_masks([name])[name]
+
+    def get_roi_masks(self, names: List[str] = None, n_workers: int = None) -> Dict[str, np.ndarray]:
+        """
+        Returns the 3D binary masks of the given ROIs (all ROIs by default), keyed by name.
+        ROIs that were not rasterized before are rasterized together, in one pass over the slices,
+        in n_workers processes (see utils.get_n_processes).
+        """
+
+        masks = {}
+        shape = image_helper.get_series_mask_shape(self.series_data)
+        for name, (bbox, cropped_mask) in self.get_cropped_roi_masks(names, n_workers).items():
+            mask = np.zeros(shape, dtype=bool)
+            if bbox is not None:
+                mask[bbox] = cropped_mask
+            masks[name] = mask
+        return masks
+
+    def get_cropped_roi_masks(self, names: List[str] = None, n_workers: int = None) -> Dict[str, tuple]:
+        """
+        Returns the masks of the given ROIs (all ROIs by default) cropped to their bounding box,
+        as name -> (bbox, mask), where bbox is a tuple of slices into the full mask.
+        Empty ROIs give (None, None).
+        """
+
+        if names is None:
+            names = self.get_roi_names()
+        roi_numbers = self.get_roi_numbers(names)
+
+        missing = list(dict.fromkeys(
+            roi_numbers[name] for name in names if roi_numbers[name] not in self.mask_cache
+        ))
+        if missing:
+            contour_sequences = ds_helper.get_contour_sequences_by_roi_number(self.ds)
+            for roi_number in missing:
+                if roi_number not in contour_sequences:
+                    raise Exception(f"Referenced ROI number '{roi_number}' not found")
+            cropped_masks = image_helper.create_series_masks_from_contour_sequences(
+                self.series_data,
+                [contour_sequences[roi_number] for roi_number in missing],
+                n_workers,
+            )
+            self.mask_cache.update(zip(missing, cropped_masks))
+
+        return {name: self.mask_cache[roi_numbers[name]] for name in names}
+
+    def get_roi_fractions(self, names: List[str] = None, supersampling: int = 4) -> Dict[str, tuple]:
+        """
+        Returns the partial-volume fractions (the part of every voxel inside the contours, float32)
+        of the given ROIs (all ROIs by default), cropped to their bounding box as name -> (bbox, fractions),
+        as get_cropped_roi_masks. Fractions are computed on a grid supersampled supersampling times in-plane.
+        """
+
+        if names is None:
+            names = self.get_roi_names()
+        roi_numbers = self.get_roi_numbers(names)
+        contour_sequences = ds_helper.get_contour_sequences_by_roi_number(self.ds)
+        for roi_number in roi_numbers.values():
+            if roi_number not in contour_sequences:
+                raise Exception(f"Referenced ROI number '{roi_number}' not found")
+
+        cropped_fractions = image_helper.create_series_fractions_from_contour_sequences(
+            self.series_data,
+            [contour_sequences[roi_numbers[name]] for name in names],
+            supersampling,
+        )
+        return dict(zip(names, cropped_fractions))
+
+    def get_roi_numbers(self, names: List[str]) -> Dict[str, str]:
+        """
+        Returns the ROI numbers (as strings) of the given ROI names
+        """
+
+        roi_numbers = {
+            structure_roi.ROIName: str(structure_roi.ROINumber)
+            for structure_roi in reversed(self.ds.StructureSetROISequence)
+        }  # The first ROI of a given name wins, as in a linear scan
+        for name in names:
+            if name not in roi_numbers:
+                raise RTStruct.ROIException(f"ROI of name `{name}` does not exist in RTStruct")
+        return {name: roi_numbers[name] for name in names}
+
+    def get_roi_labelmap(self, names: List[str] = None, n_workers: int = None) -> np.ndarray:
+        """
+        Returns a labelmap of the given ROIs (all ROIs by default), where ROI names[i] has label i + 1
+        and 0 is background. Where ROIs overlap, the later one in names wins.
+        """
+
+        if names is None:
+            names = self.get_roi_names()
+        dtype = np.uint8 if len(names) < 2**8 else np.uint16
+        shape = image_helper.get_series_mask_shape(self.series_data)
+        labelmap = np.zeros(shape, dtype=dtype)
+        cropped_masks = self.get_cropped_roi_masks(names, n_workers)
+        for i, name in enumerate(names):
+            bbox, cropped_mask = cropped_masks[name]
+            if bbox is not None:
+                labelmap[bbox][cropped_mask] = i + 1
+        return labelmap
+
+    def clear_mask_cache(self):
+        """
+        Forgets all rasterized ROIs. Needed after the ROI sequences of the dataset are edited directly.
+        """
 
-        raise RTStruct.ROIException(f"ROI of name `{name}` does not exist in RTStruct")
+        self.mask_cache.clear()
 
     def save(self, file_path: str):
         """
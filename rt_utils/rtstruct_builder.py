@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from pydicom.dataset import Dataset
 from pydicom.filereader import dcmread
 
@@ -15,12 +15,12 @@ class RTStructBuilder:
     """
 
     @staticmethod
-    def create_new(dicom_series_path: str) -> RTStruct:
+    def create_new(dicom_series_path: str, series_instance_uid: Optional[str] = None) -> RTStruct:
         """
         Method to generate a new rt struct from a DICOM series
         """
 
-        series_data = image_helper.load_sorted_image_series(dicom_series_path)
+        series_data = image_helper.load_sorted_image_series(dicom_series_path, series_instance_uid)
         ds = ds_helper.create_rtstruct_dataset(series_data)
         return RTStruct(series_data, ds)
 
@@ -30,9 +30,11 @@ class RTStructBuilder:
         Method to load an existing rt struct, given related DICOM series and existing rt struct
         """
 
-        series_data = image_helper.load_sorted_image_series(dicom_series_path)
         ds = dcmread(rt_struct_path)
         RTStructBuilder.validate_rtstruct(ds)
+        series_data = image_helper.load_sorted_image_series(
+            dicom_series_path, RTStructBuilder.get_referenced_series_uid(ds)
+        )
         RTStructBuilder.validate_rtstruct_series_references(ds, series_data, warn_only)
 
         # TODO create new frame of reference? Right now we assume the last frame of reference created is suitable
@@ -52,6 +54,18 @@ class RTStructBuilder:
         ):
             raise Exception("Please check that the existing RTStruct is valid")
 
+    @staticmethod
+    def get_referenced_series_uid(ds: Dataset) -> Optional[str]:
+        """
+        Method to get the SeriesInstanceUID of the image series an RTStruct was drawn on, if it is recorded
+        """
+        for refd_frame_of_ref in getattr(ds, "ReferencedFrameOfReferenceSequence", []):
+            for rt_refd_study in getattr(refd_frame_of_ref, "RTReferencedStudySequence", []):
+                for rt_refd_series in getattr(rt_refd_study, "RTReferencedSeriesSequence", []):
+                    if "SeriesInstanceUID" in rt_refd_series:
+                        return rt_refd_series.SeriesInstanceUID
+        return None
+
     @staticmethod
     def validate_rtstruct_series_references(ds: Dataset, series_data: List[Dataset], warn_only: bool = False):
         """
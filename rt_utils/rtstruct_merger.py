@@ -1,33 +1,45 @@
+from typing import List
+from pydicom.filereader import dcmread
+
 from .rtstruct import RTStruct
 from .rtstruct_builder import RTStructBuilder
-from . import ds_helper, image_helper
 
 class RTStructMerger:
 
 
     @staticmethod
-    def merge_rtstructs(dicom_series_path: str, rt_struct_path1: str, 
+    def merge_rtstructs(dicom_series_path: str, rt_struct_path1: str,
         rt_struct_path2: str) -> RTStruct:
         """
         Method to merge two existing RTStruct files belonging to same series data, returning them as one RTStruct
         """
 
-        rtstruct1 = RTStructBuilder.create_from(dicom_series_path, rt_struct_path1)
-        rtstruct2 = RTStructBuilder.create_from(dicom_series_path, rt_struct_path2)
-        
-        for roi_contour_seq, struct_set_roi_seq, rt_roi_observation_seq in zip(rtstruct1.ds.ROIContourSequence, rtstruct1.ds.StructureSetROISequence, rtstruct1.ds.RTROIObservationsSequence):
-            roi_number = len(rtstruct2.ds.StructureSetROISequence) + 1
-            roi_contour_seq.ReferencedROINumber = roi_number
-            struct_set_roi_seq.ROINumber = roi_number
-            rt_roi_observation_seq.ReferencedROINumber = roi_number
-
-            # check for ROI name duplication
-            for struct_set_roi_seq2 in rtstruct2.ds.StructureSetROISequence:
-                if struct_set_roi_seq.ROIName == struct_set_roi_seq2.ROIName:
-                    struct_set_roi_seq += "_2"
-
-            rtstruct2.ds.ROIContourSequence.append(roi_contour_seq)
-            rtstruct2.ds.StructureSetROISequence.append(struct_set_roi_seq)
-            rtstruct2.ds.RTROIObservationsSequence.append(rt_roi_observation_seq)
-
-        return rtstruct2
\ No newline at end of file
+        return RTStructMerger.merge_rtstruct_list(dicom_series_path, [rt_struct_path2, rt_struct_path1])
+
+    @staticmethod
+    def merge_rtstruct_list(dicom_series_path: str, rt_struct_paths: List[str]) -> RTStruct:
+        """
+        Method to merge any number of existing RTStruct files belonging to same series data, returning them as one RTStruct.
+        The series and every RTStruct file are read once. The ROIs of the later files are appended to the first one,
+        renumbered after the existing ROIs; duplicate names get a suffix (_2, _3, ...).
+        """
+
+        merged = RTStructBuilder.create_from(dicom_series_path, rt_struct_paths[0])
+        names = set(merged.get_roi_names())
+
+        for rt_struct_path in rt_struct_paths[1:]:
+            ds = dcmread(rt_struct_path)
+            RTStructBuilder.validate_rtstruct(ds)
+            RTStructBuilder.validate_rtstruct_series_references(ds, merged.series_data)
+            rtstruct = RTStruct(merged.series_data, ds)
+
+            for structure_roi in ds.StructureSetROISequence:
+                name = new_name = structure_roi.ROIName
+                i = 1
+                while new_name in names:
+                    i += 1
+                    new_name = f"{name}_{i}"
+                merged.copy_roi_from(rtstruct, name, new_name, roi_number=structure_roi.ROINumber)
+                names.add(new_name)
+
+        return merged
@@ -1,4 +1,5 @@
-from typing import List, Union
+import os
+from typing import List, Optional, Union
 from random import randrange
 from pydicom.uid import PYDICOM_IMPLEMENTATION_UID
 from dataclasses import dataclass
@@ -30,12 +31,32 @@ COLOR_PALETTE = [
 ROI_GENERATION_ALGORITHMS = ["AUTOMATIC", "SEMIAUTOMATIC", "MANUAL"]
 
 
+def get_n_processes(n_workers: Optional[int]) -> int:
+    """
+    Number of processes for an n_workers argument. This is the meaning of n_workers everywhere in
+    rt_utils and in the conversion functions built on it: None or 1 runs serially in the calling process,
+    n > 1 uses a pool of n processes and -1 uses all cores.
+    (Reading image headers and pixel data uses threads, for which None is the default thread count.)
+    """
+    if n_workers is None:
+        return 1
+    if n_workers == -1:
+        return os.cpu_count() or 1
+    if n_workers < 1:
+        raise ValueError(f"Invalid number of workers: {n_workers}")
+    return n_workers
+
+
 class SOPClassUID:
     RTSTRUCT_IMPLEMENTATION_CLASS = (
         PYDICOM_IMPLEMENTATION_UID  # TODO find out if this is ok
     )
     DETACHED_STUDY_MANAGEMENT = "1.2.840.10008.3.1.2.3.1"
     RTSTRUCT = "1.2.840.10008.5.1.4.1.1.481.3"
+    CT_IMAGE = "1.2.840.10008.5.1.4.1.1.2"
+    MR_IMAGE = "1.2.840.10008.5.1.4.1.1.4"
+    PET_IMAGE = "1.2.840.10008.5.1.4.1.1.128"
+    IMAGE_STORAGE = (CT_IMAGE, MR_IMAGE, PET_IMAGE)
 
 
 @dataclass
@@ -0,0 +1,132 @@
+import numpy as np
+import numbers
+from scipy.linalg import expm
+from scipy.stats import gamma
+
+
+class AnalyticalDose:
+    """
+    Deterministic counterpart of CompartmentDose, meant for fast plan screening.
+    Instead of accumulating dose in simulated particles, the first two moments of the blood dose are solved for
+    directly from the rate matrix of the flow model.
+
+    The flow is treated as a continuous-time Markov process (exponential transit times, i.e. Weibull shape = 1).
+    The mean blood dose is exact for any transit time distribution; the variance is that of the Markov process.
+    With p(t) the compartment occupation probabilities, m1(t) = E[D(t); X(t)] and m2(t) = E[D(t)^2; X(t)],
+        dp/dt = p Q,    dm1/dt = m1 Q + p F(t),    dm2/dt = m2 Q + 2 m1 F(t),
+    with Q the generator (rate matrix) and F(t) the diagonal matrix of compartmental dose rates.
+    As F(t) is piecewise constant (beams), this is solved exactly by a matrix exponential per time segment.
+    """
+    def __init__(self, model):
+        """
+        model : FlowModel (or ExpandFlowModel), after all boxes have been added.
+        """
+        self.model = model
+        self.size = len(model.names)
+        self.dt = model.dt
+        # generator of the Markov process:
+        self.generator = model.get_ordered_rate_matrix()
+        np.fill_diagonal(self.generator, 0.0)
+        np.fill_diagonal(self.generator, -np.sum(self.generator, axis=1))
+        # the system is in equilibrium right from the start:
+        self.p0 = model.volumes / np.sum(model.volumes)
+
+        # list of (dose rate per compartment, dose rate variance per compartment, start_time, beam_on_time):
+        self.beams = []
+        self.mean = None
+        self.var = None
+
+    def add_dose(self, dose_rate, compartment_ids, start_time, beam_on_time):
+        """
+        Same arguments as CompartmentDose.add_dose.
+        dose_rate           : either a value (homogeneous dose) or dose histogram (heterogeneous dose distribution).
+        compartment_ids     : list of compartment ids that gets the given dose.
+        start_time          : time-point beam starts to delivery
+        beam_on_time        : duration of the applied dose
+        """
+        assert (isinstance(dose_rate, numbers.Number) or isinstance(dose_rate, tuple)), \
+            'dose_function needs to be either a value (homogeneous dose) ' \
+            'or the output of np.histogram (a tuple for heterogeneous dose).'
+        if compartment_ids is None:
+            return 0
+        if not isinstance(compartment_ids, list):
+            compartment_ids = [compartment_ids]
+
+        if isinstance(dose_rate, numbers.Number):
+            rate_mean, rate_var = dose_rate, 0.0
+        else:
+            # same dose values as sampled in CompartmentDose.add_dose:
+            dose_values = (dose_rate[1][1:] + dose_rate[1][:-1] - np.diff(dose_rate[1])) / 2
+            p = dose_rate[0] / np.sum(dose_rate[0])
+            rate_mean = np.sum(p * dose_values)
+            rate_var = np.sum(p * np.square(dose_values)) - rate_mean ** 2
+
+        f = np.zeros(self.size)
+        f_var = np.zeros(self.size)
+        f[compartment_ids] = rate_mean
+        f_var[compartment_ids] = rate_var
+        self.beams.append((f, f_var, start_time, beam_on_time))
+
+    def _segments(self):
+        """
+        Split the time axis at all beam starts and ends; the dose rates are constant within each segment.
+        """
+        edges = np.unique([0.0] + [t for _, _, start, duration in self.beams for t in (start, start + duration)])
+        for t0, t1 in zip(edges[:-1], edges[1:]):
+            f = np.zeros(self.size)
+            f_var = np.zeros(self.size)
+            for beam_f, beam_f_var, start, duration in self.beams:
+                if start <= t0 and t1 <= start + duration:
+                    f += beam_f
+                    f_var += beam_f_var
+            yield f, f_var, t1 - t0
+
+    def solve(self):
+        """
+        Integrate the moment equations over all beams. Typically takes a few milliseconds.
+        """
+        n = self.size
+        state = np.concatenate([self.p0, np.zeros(2 * n)])
+        # variance due to sampling a new dose rate from the histogram at every time step of the simulation:
+        sampling_var = 0.0
+        for f, f_var, duration in self._segments():
+            a = np.zeros((3 * n, 3 * n))
+            a[:n, :n] = a[n:2 * n, n:2 * n] = a[2 * n:, 2 * n:] = self.generator
+            a[:n, n:2 * n] = np.diag(f)
+            a[n:2 * n, 2 * n:] = 2 * np.diag(f)
+            sampling_var += self.dt * duration * np.sum(f_var * state[:n])
+            state = state @ expm(a * duration)
+        self.mean = np.sum(state[n:2 * n])
+        self.var = max(np.sum(state[2 * n:]) - self.mean ** 2, 0.0) + sampling_var
+        return self.mean, np.sqrt(self.var)
+
+    def repeat(self, n_fractions):
+        """
+        Dose accumulation over multiple fractions, assuming total mixing in between (cf. CompartmentDose.repeat).
+        """
+        self.mean *= n_fractions
+        self.var *= n_fractions
+
+    def _gamma_params(self):
+        # the blood dose distribution is approximated by a gamma distribution with matching moments.
+        shape = self.mean ** 2 / self.var
+        scale = self.var / self.mean
+        return shape, scale
+
+    def volume_gt_dose(self, threshold):
+        """
+        threshold: threshold dose (Gy)
+        return (approximate) volume (%) of BP g.t threshold, mean dose, std dose
+        """
+        if self.var == 0:
+            above = float(self.mean > threshold)
+            return 100.0 * above, self.mean if above else np.nan, 0.0 if above else np.nan
+        shape, scale = self._gamma_params()
+        sf = gamma.sf(threshold, shape, scale=scale)
+        if sf == 0:
+            return 0.0, np.nan, np.nan
+        # partial moments of the gamma distribution:
+        mean_above = shape * scale * gamma.sf(threshold, shape + 1, scale=scale) / sf
+        second_moment_above = shape * (shape + 1) * scale ** 2 * gamma.sf(threshold, shape + 2, scale=scale) / sf
+        std_above = np.sqrt(max(second_moment_above - mean_above ** 2, 0.0))
+        return 100.0 * sf, mean_above, std_above
@@ -4,19 +4,29 @@ import copy
 from simulation import Weibull
 
 
+def path_dtype(size):
+    """
+    Smallest unsigned integer type that can hold the ids of all compartments in a path.
+    """
+    return np.uint8 if size <= np.iinfo(np.uint8).max + 1 else np.uint16
+
+
 class Chain:
-    def __init__(self, names, prob, mtt, dt, k):
+    def __init__(self, names, prob, mtt, dt, k, multi_rate=False):
         """
-        names  : list of names of compartments
-        prob   : 2d square matrix
-        scales : 1d array
-        shapes : 1d array
+        names      : list of names of compartments
+        prob       : 2d square matrix
+        scales     : 1d array
+        shapes     : 1d array
+        multi_rate : use the event-driven walk (walk_multi_rate), so that dt is not limited by the fastest compartment
         """
         # some checks:
         assert(prob.shape[0] == prob.shape[1] == len(names) == mtt.size), 'Dimensions do not match.'
         self.prob = copy.deepcopy(prob)
         self.size = prob.shape[0]
         self.dt = dt
+        self.dtype = path_dtype(self.size)
+        self.multi_rate = multi_rate
         self.progress = 0
 
         # list of weibull distributions to determine leave or stay
@@ -35,7 +45,7 @@ class Chain:
         The time t is initial aging at the compartment.
         It is initialized so that system is in equilibrium right from the start.
         """
-        path = np.empty(shape=(c.size, n_steps+1), dtype=np.uint8)
+        path = np.empty(shape=(c.size, n_steps+1), dtype=self.dtype)
         path[:, 0] = c
 
         # initialize dwell times of particles:
@@ -58,7 +68,56 @@ class Chain:
                     else:
                         c[change_indices] = self.options[i][0][0]
                     t[change_indices] = 0
-            path[:, step + 1] = np.uint8(c)
+            path[:, step + 1] = c
+            # print progress:
+            self._print_progress(n_steps, step)
+        return path
+
+    def walk_multi_rate(self, n_steps, c):
+        """
+        Same as walk_v1, but event-driven within each time step, so that dt is not limited by the fastest
+        compartment: the exit time of every particle is drawn exactly (see Weibull.residual_time), and a particle
+        leaving before the end of the step carries the time left over into its next compartment, possibly passing
+        through several (fast) compartments within a single time step.
+        Only the compartment at the end of each time step is stored in the path.
+        """
+        path = np.empty(shape=(c.size, n_steps+1), dtype=self.dtype)
+        path[:, 0] = c
+
+        # initialize dwell times of particles:
+        t = np.empty(shape=c.size, dtype=np.float64)
+        for i, comp in enumerate(self.comp):
+            indices = np.where(c == i)[0]
+            t[indices] = comp.initial_time_distribution(indices)
+
+        # loop over time steps:
+        for step in range(n_steps):
+            # time left in the current time step, per particle:
+            remaining = np.full(shape=c.size, fill_value=self.dt)
+            active = np.arange(c.size)
+            while active.size > 0:
+                c_active = c[active]
+                for i, comp in enumerate(self.comp):
+                    indices = active[c_active == i]
+                    if indices.size == 0:
+                        continue
+                    tau = comp.residual_time(t[indices])
+                    leaving = tau < remaining[indices]
+                    # the others stay until the end of the step:
+                    staying = indices[~leaving]
+                    t[staying] += remaining[staying]
+                    remaining[staying] = 0
+                    change_indices = indices[leaving]
+                    if change_indices.size > 0:
+                        remaining[change_indices] -= tau[leaving]
+                        if self.options[i][0].size > 1:
+                            c[change_indices] = np.random.choice(self.options[i][0], size=change_indices.size,
+                                                                 p=self.options[i][1])
+                        else:
+                            c[change_indices] = self.options[i][0][0]
+                        t[change_indices] = 0
+                active = active[remaining[active] > 0]
+            path[:, step + 1] = c
             # print progress:
             self._print_progress(n_steps, step)
         return path
@@ -74,7 +133,7 @@ class Chain:
         NOTE: watch out with indexing; don't do something like t[indices1][indices2] = arr
         (the first indexing creates a copy instead of a view). Instead, do t[indices1[indices2]] = arr.
         """
-        path = np.empty(shape=(c.size, n_steps+1), dtype=np.uint8)
+        path = np.empty(shape=(c.size, n_steps+1), dtype=self.dtype)
         path[:, 0] = c
 
         # initialize transit times and initial times:
@@ -101,7 +160,7 @@ class Chain:
                     else:
                         c[change_indices] = self.options[i][0][0]
                     t[change_indices] = 0
-            path[:, step + 1] = np.uint8(c)
+            path[:, step + 1] = c
             # print progress:
             self._print_progress(n_steps, step)
         return path
@@ -125,6 +184,7 @@ class MarkovChain:
         self.names = names
         self.prob = copy.deepcopy(prob)
         self.size = prob.shape[0]
+        self.dtype = path_dtype(self.size)
 
         # leaving probabilities:
         self.p_leaving = 1 - np.diag(self.prob)
@@ -142,7 +202,7 @@ class MarkovChain:
         return p > random_numbers
 
     def walk(self, n_steps, c):
-        path = np.zeros(shape=(c.size, n_steps+1), dtype=np.uint8)
+        path = np.zeros(shape=(c.size, n_steps+1), dtype=self.dtype)
         path[:, 0] = c
 
         for step in range(n_steps):
@@ -153,5 +213,5 @@ class MarkovChain:
                 change = self.is_leaving(indices.size, i, random_numbers[indices])
                 c_copy[indices[change]] = np.random.choice(self.size, size=np.sum(change), p=self.prob[i])
             c = c_copy
-            path[:, step + 1] = np.uint8(c)
+            path[:, step + 1] = c
         return path
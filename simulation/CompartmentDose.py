@@ -111,27 +111,38 @@ class CompartmentDose:
             indices = np.where(in_compartment[:, step])[0]
             indices_inject = np.setdiff1d(indices, indices_old, assume_unique=True)
             indices_eject = np.setdiff1d(indices_old, indices, assume_unique=True)
-            idx = np.random.choice(all_idx, size=indices_inject.size)
-            pos[indices_inject] = self.positions[idx]
+            if all_idx.size == 0:
+                # the organ lies entirely outside the (cropped) segmentation, i.e. outside_fraction == 1:
+                # particles entering it get no position and receive no dose.
+                pos[indices_inject] = np.nan
+            else:
+                idx = np.random.choice(all_idx, size=indices_inject.size)
+                pos[indices_inject] = self.positions[idx]
+            if self.outside_fraction > 0:
+                # particles entering the part of the organ that was cropped away (negligible dose) get no position:
+                pos[indices_inject[np.random.uniform(size=indices_inject.size) < self.outside_fraction]] = np.nan
+            moving = indices_old[~np.isnan(pos[indices_old, 0])]
             # this is of course not entirely correct, you would want to sample the step_size,
             # uniformly picking the direction. Good enough though (it's an approx anyway):
-            dist = np.random.uniform(0, self.step_size, size=indices_old.size * 3).reshape(indices_old.size, 3)
+            dist = np.random.uniform(0, self.step_size, size=moving.size * 3).reshape(moving.size, 3)
             # check if particles are still inside organ, reject the moves for those who landed outside.
-            d = self.kd_tree.query(pos[indices_old] + dist, k=1)[0]
+            d = self.kd_tree.query(pos[moving] + dist, k=1)[0]
             idx_accept = np.where(d < self.d_max)[0]
             if d.size > 0:
                 accept_perc.append(idx_accept.size / d.size)
             # move the particles:
-            pos[indices_old[idx_accept]] += dist[idx_accept]
+            pos[moving[idx_accept]] += dist[idx_accept]
             # discard the particles that have left the compartment:
             pos[indices_eject] = np.nan
             indices_old = indices
             # accumulate dose
-            self.dose[indices] += self.dt * dose_rate_func(pos[indices])
-        print('Percentage accepted: {:.2f}%'.format(sum(accept_perc)/len(accept_perc) * 100))
+            inside = indices[~np.isnan(pos[indices, 0])]
+            self.dose[inside] += self.dt * dose_rate_func(pos[inside])
+        if accept_perc:
+            print('Percentage accepted: {:.2f}%'.format(sum(accept_perc)/len(accept_perc) * 100))
         print('Dose added.')
 
-    def _prepare(self, grid, seg, down_sample):
+    def _prepare(self, grid, seg, down_sample, outside_fraction=0.0, spacing=None):
         """
         Prepare for the random walk.
         Velocity is a free parameter whose influence can be studied,
@@ -139,8 +150,19 @@ class CompartmentDose:
         i.e. velocity=0 --> stationary simulation particles while in compartment.
         Of course, in reality, simulation flow has much more directionality than just random,
         could potentially be implemented with Levy flights or by adding momentum...
+        outside_fraction is the fraction of the organ that is not part of the (cropped) segmentation;
+        particles entering that part receive no dose.
+        spacing is the voxel spacing of grid (e.g. from the affine of the patient); by default it is taken from
+        the grid itself, which needs at least two points along every axis.
         """
+        if spacing is None:
+            if min(len(grid[i]) for i in range(3)) < 2:
+                raise ValueError('Cannot take the grid spacing from a grid with a single point along an axis, '
+                                 'pass spacing.')
+            spacing = [grid[i][1] - grid[i][0] for i in range(3)]
+        gridspacing = np.abs(np.asarray(spacing, dtype=float))
         if down_sample is not None:
+            gridspacing = gridspacing * np.asarray(down_sample)
             grid = tuple(grid[i][::down_sample[i]] for i in range(3))
             seg = seg[::down_sample[0], ::down_sample[1], ::down_sample[2]]
         seg_idx = np.where(seg == 1)
@@ -148,14 +170,14 @@ class CompartmentDose:
         self.positions = gridpts[seg_idx[0], seg_idx[1], seg_idx[2]]
         self.kd_tree = KDTree(self.positions)
         # tolerance:
-        gridspacing = np.array([np.diff(grid[i])[0] for i in range(3)])
         self.d_max = np.sqrt(np.sum(np.square(0.5 * gridspacing)))
         # velocity of particles:
         velocity = 20
         self.step_size = velocity * self.dt
+        self.outside_fraction = outside_fraction
 
-    def prepare(self, grid, seg, down_sample=None):
-        self._prepare(grid, seg, down_sample=down_sample)
+    def prepare(self, grid, seg, down_sample=None, outside_fraction=0.0, spacing=None):
+        self._prepare(grid, seg, down_sample=down_sample, outside_fraction=outside_fraction, spacing=spacing)
 
     def repeat(self, n_fractions):
         """
@@ -3,7 +3,56 @@ from scipy import interpolate
 import pandas as pd
 
 
-def field_to_func(vol, gridpoints):
+class UniformGridInterpolator:
+    """
+    Drop-in replacement for RegularGridInterpolator(bounds_error=False, fill_value=0) when the grid is uniform
+    (as given by vol_to_gridpoints). Coordinates are converted to indices arithmetically (no searching),
+    and values are looked up (nearest) or trilinearly interpolated on a float32 copy of the volume.
+    Points outside the grid (or NaN) evaluate to zero.
+    """
+    def __init__(self, gridpoints, vol, method='linear'):
+        assert (method in ['linear', 'nearest']), 'method should be "linear" or "nearest".'
+        self.method = method
+        self.values = np.ascontiguousarray(vol, dtype=np.float32).ravel()
+        self.shape = np.array(vol.shape)
+        self.strides = np.array([self.shape[1] * self.shape[2], self.shape[2], 1])
+        self.origin = np.array([g[0] for g in gridpoints], dtype=np.float64)
+        self.spacing = np.array([g[1] - g[0] if len(g) > 1 else 1.0 for g in gridpoints], dtype=np.float64)
+
+    def __call__(self, points):
+        points = np.asarray(points, dtype=np.float64)
+        out_shape = points.shape[:-1]
+        # fractional indices:
+        f = (points.reshape(-1, 3) - self.origin) / self.spacing
+        inside = np.all((f >= 0) & (f <= self.shape - 1), axis=1)
+        result = np.zeros(f.shape[0], dtype=np.float32)
+        f = f[inside]
+        if self.method == 'nearest':
+            result[inside] = self.values[np.rint(f).astype(np.int64) @ self.strides]
+        else:
+            i0 = np.minimum(np.floor(f).astype(np.int64), np.maximum(self.shape - 2, 0))
+            w1 = (f - i0).astype(np.float32)
+            w0 = 1 - w1
+            base = i0 @ self.strides
+            # flat offsets to the upper neighbours (zero along axes of length 1):
+            step = np.where(self.shape > 1, self.strides, 0)
+            value = np.zeros(f.shape[0], dtype=np.float32)
+            for dx in (0, 1):
+                wx = w1[:, 0] if dx else w0[:, 0]
+                for dy in (0, 1):
+                    wxy = wx * (w1[:, 1] if dy else w0[:, 1])
+                    for dz in (0, 1):
+                        weight = wxy * (w1[:, 2] if dz else w0[:, 2])
+                        value += weight * self.values[base + dx * step[0] + dy * step[1] + dz * step[2]]
+            result[inside] = value
+        return result.reshape(out_shape)
+
+
+def _is_uniform(gridpoints):
+    return all(len(g) < 3 or np.allclose(np.diff(g), g[1] - g[0], rtol=1e-6, atol=0) for g in gridpoints)
+
+
+def field_to_func(vol, gridpoints, method='linear'):
     """
     Create function from volume values
     Parameters
@@ -11,13 +60,16 @@ def field_to_func(vol, gridpoints):
     vol: ndarray (3D), required.
         volume to be used for the interpolation.
     gridpoints: tuple of x, y, z coordinates, required.
+    method: 'linear' or 'nearest'.
 
     Returns
     -------
     field_fn: function.
-        function representation of the volume.
+        function representation of the volume (zero outside the grid).
     """
-    field_fn = interpolate.RegularGridInterpolator(gridpoints, vol, bounds_error=False, fill_value=0)
+    if _is_uniform(gridpoints):
+        return UniformGridInterpolator(gridpoints, vol, method=method)
+    field_fn = interpolate.RegularGridInterpolator(gridpoints, vol, method=method, bounds_error=False, fill_value=0)
     return field_fn
 
 
@@ -44,18 +96,35 @@ class DoseRate:
         self.dose_rate_func = field_to_func(self.dose_rate, self.patient.gridpoints)
 
     def get_dose_rate_hist(self, organ_name):
-        bin_size = 0.1 / self.n_fractions / self.total_beam_on_time
-        bin_max = np.ceil(np.max(self.patient.dose)) / self.n_fractions / self.total_beam_on_time
-        bins = np.arange(0, bin_max + bin_size, bin_size)
-        idx = np.where(self.patient.seg_organs[organ_name] == 1)
-        dose_rate = self.dose_rate[idx[0], idx[1], idx[2]]
-        frequency, dose_rate_bins = np.histogram(dose_rate, bins=bins, density=True)
-        frequency *= bin_size * 100
+        """
+        Dose rate histogram (% of organ volume per bin) derived from the patient's cached dose histogram.
+        For fractional segmentations, voxels are weighted with the part of them inside the organ.
+        """
+        values, dose_bins = self.patient.get_dose_histogram(organ_name)
+        frequency = values / np.sum(values) * 100
+        dose_rate_bins = dose_bins / self.n_fractions / self.total_beam_on_time
+        return frequency, dose_rate_bins
+
+    def get_beam_dose_rate_func(self, beam_name, beam_on_time):
+        """
+        Dose rate of a single beam (per fraction) during its beam-on time, as an interpolated function.
+        """
+        beam_dose_rate = self.patient.get_beam_dose(beam_name) / self.n_fractions / beam_on_time
+        return field_to_func(beam_dose_rate, self.patient.gridpoints)
+
+    def get_beam_dose_rate_hist(self, organ_name, beam_name, beam_on_time):
+        """
+        Dose rate histogram (% of organ volume per bin) of a single beam during its beam-on time.
+        """
+        values, dose_bins = self.patient.get_beam_dose_histogram(organ_name, beam_name)
+        frequency = values / np.sum(values) * 100
+        dose_rate_bins = dose_bins / self.n_fractions / beam_on_time
         return frequency, dose_rate_bins
 
     def calculate_mean_blood_dose(self, total_blood_volume, blood_volumes, accumulate=False):
-        mean_organ_doses = np.array([self.get_mean_organ_dose(organ_name, accumulate=accumulate)
-                                     for organ_name in self.patient.seg_organs.keys()])
+        mean_organ_doses = self.patient.get_mean_organ_doses(list(self.patient.seg_organs.keys()))
+        if not accumulate:
+            mean_organ_doses = mean_organ_doses / self.n_fractions
         self.MBD = np.sum(blood_volumes * mean_organ_doses) / total_blood_volume
 
 
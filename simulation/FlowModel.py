@@ -1,3 +1,4 @@
+import copy
 import numpy as np
 import networkx as nx
 import pandas as pd
@@ -51,10 +52,20 @@ class FlowModel:
         k_matrix /= self.volumes[:, None]
         return k_matrix
 
-    def _get_mtts(self):
+    def _node_order(self):
         # sort (graph does not have an order necessarily).
-        idx = np.array([list(self.G.nodes.keys()).index(name) for name in self.names], dtype=int)
-        self.mtt = 1 / np.sum(self.k_matrix, axis=1)[idx]
+        node_index = {node: i for i, node in enumerate(self.G.nodes)}
+        return np.array([node_index[name] for name in self.names], dtype=int)
+
+    def get_ordered_rate_matrix(self):
+        """
+        Rate matrix (1/s) with rows and columns in the order of self.names.
+        """
+        idx = self._node_order()
+        return self.k_matrix[idx][:, idx]
+
+    def _get_mtts(self):
+        self.mtt = 1 / np.sum(self.k_matrix, axis=1)[self._node_order()]
 
     def _rate_matrix_to_graph(self):
         # condense flow kinetics in a directed graph with rates k
@@ -68,22 +79,50 @@ class FlowModel:
     def _graph_to_rate_matrix(self):
         self.k_matrix = nx.to_numpy_array(self.G, weight='k')
 
-    def _get_transition_matrix(self):
+    def rescale(self, total_volume, total_flow):
+        """
+        Rescale the model to another total blood volume (L) and cardiac output (L/s).
+        Volumes scale with the TBV and flows with the CO, hence all rates scale with CO / TBV.
+        The relative volumes (and thus cum_volume) do not change.
+        """
+        volume_scale = total_volume / self.total_volume
+        flow_scale = total_flow / self.total_flow
+        rate_scale = flow_scale / volume_scale
+        self.total_volume = total_volume
+        self.total_flow = total_flow
+        self.volumes = self.volumes * volume_scale
+        self.flows = self.flows * flow_scale
+        self.particle_volume = self.total_volume / self.sample_size
+        self.k_matrix = self.k_matrix * rate_scale
+        self.mtt = self.mtt / rate_scale
+        nx.set_node_attributes(self.G, dict(zip(self.names, self.volumes)), 'V')
+        for _, _, edge in self.G.edges(data=True):
+            edge['k'] *= rate_scale
+        # the transition matrix and chain are no longer valid:
+        self.prob = None
+        self.chain = None
+
+    def _get_transition_matrix(self, multi_rate=False):
         # convert the graph into a transition matrix.
         self._graph_to_rate_matrix()
-        self.prob = self.k_matrix * self.dt
-        # sort (graph does not have an order necessarily).
-        idx = np.array([list(self.G.nodes.keys()).index(name) for name in self.names], dtype=int)
-        self.prob = self.prob[idx][:, idx]
+        self.prob = self.get_ordered_rate_matrix() * self.dt
+        if multi_rate:
+            # exit times are drawn exactly, only where particles go (the relative rates) is used:
+            np.fill_diagonal(self.prob, 0.0)
+            return
         assert(np.array(np.sum(self.prob, axis=1) < np.ones(self.prob.shape[0])).all()), \
-            'time step size is too large; leaving probabilities > 1 encountered.'
+            'time step size is too large; leaving probabilities > 1 encountered (consider multi-rate stepping).'
         # probability of staying
         np.fill_diagonal(self.prob, 1.0 - np.sum(self.prob, axis=1))
 
-    def construct_weibull(self):
-        self._get_transition_matrix()
+    def construct_weibull(self, multi_rate=False):
+        """
+        multi_rate : if True, exit times are drawn exactly within each step (particles may pass through
+                     several fast compartments per step), so that dt is no longer limited by the fastest compartment.
+        """
+        self._get_transition_matrix(multi_rate)
         # Construct jumping process using Weibull distribution
-        self.chain = Chain(self.names, self.prob, self.mtt, dt=self.dt, k=self.weibull_shape)
+        self.chain = Chain(self.names, self.prob, self.mtt, dt=self.dt, k=self.weibull_shape, multi_rate=multi_rate)
 
     def construct_markov(self):
         self._get_transition_matrix()
@@ -97,12 +136,14 @@ class ExpandFlowModel(FlowModel):
     In this implementation, the tumor box get added in parallel to the tumor-site from which it 'steals' simulation.
     How much? That is given by the volume fraction (size)
     and the relative simulation density and perfusion of tumor vs tumor-site.
+    Multiple boxes (e.g. metastases or nodal targets) can be added at once with split_boxes_parallel.
     """
     def __init__(self, filename, patient_params, simulation_params):
         # inherit from base class:
         FlowModel.__init__(self, filename, patient_params, simulation_params)
 
     def _add_box(self, name, site, blood_volume_fraction):
+        assert (name not in self.names), 'Compartment {} already exists.'.format(name)
         idx = self.names.index(site)
         self.size += 1
         self.names.insert(idx + 1, name)
@@ -111,20 +152,15 @@ class ExpandFlowModel(FlowModel):
         orig_volume = self.volumes[idx]
         self.volumes[idx] = (1 - blood_volume_fraction) * orig_volume
         self.volumes = np.insert(self.volumes, idx + 1, blood_volume_fraction * orig_volume)
-        self.cum_volume = np.cumsum(self.volumes) / np.sum(self.volumes)
         self.G.nodes[site]['V'] = self.volumes[idx]
         self.G.add_node(name, V=self.volumes[idx + 1])
         return idx
 
-    def split_box_parallel(self, name, box_dict):
-        site = box_dict['tumor_site']
-        volume_fraction = box_dict['tumor_volume_fraction']
-        relative_blood_density = box_dict['relative_blood_density']
-        relative_perfusion = box_dict['relative_perfusion']
-
-        blood_volume_fraction = volume_fraction * relative_blood_density
-        blood_flow_fraction = volume_fraction * relative_perfusion
-
+    def _split_box(self, name, site, blood_volume_fraction, blood_flow_fraction):
+        """
+        Carve a box out of the site. The fractions are relative to the current (possibly already split) site.
+        Only the graph, volumes and flows are updated here; rates and MTTs are updated by the caller.
+        """
         assert (blood_volume_fraction < 1.0), \
             'Cannot steal more than 100% of the original simulation volume.'
         assert(blood_flow_fraction < 1.0), \
@@ -137,14 +173,14 @@ class ExpandFlowModel(FlowModel):
         self.flows = np.insert(self.flows, idx + 1, blood_flow_fraction * orig_flow)
 
         # adjust network:
-        for prev_comp in self.G.predecessors(site):
+        for prev_comp in list(self.G.predecessors(site)):
             orig_rate = self.G.edges[(prev_comp, site)]['k']
             # rate changes as flow since the simulation volume of the predecessor of the site remains equal.
             site_rate = (1 - blood_flow_fraction) * orig_rate
             box_rate = blood_flow_fraction * orig_rate
             self.G.edges[(prev_comp, site)]['k'] = site_rate
             self.G.add_edge(prev_comp, name, k=box_rate)
-        for next_comp in self.G.successors(site):
+        for next_comp in list(self.G.successors(site)):
             orig_rate = self.G.edges[(site, next_comp)]['k']
             # Now both the flow and volume are different...
             site_rate = (1 - blood_flow_fraction) / (1 - blood_volume_fraction) * orig_rate
@@ -152,6 +188,84 @@ class ExpandFlowModel(FlowModel):
             self.G.edges[(site, next_comp)]['k'] = site_rate
             self.G.add_edge(name, next_comp, k=box_rate)
 
-        # the rates have changed so we have to update the rate_matrix and MTTs:
+    def _update_rates(self):
+        # the rates have changed so we have to update the rate_matrix, MTTs and cumulative volumes:
+        self.cum_volume = np.cumsum(self.volumes) / np.sum(self.volumes)
         self._graph_to_rate_matrix()
         self._get_mtts()
+
+    @staticmethod
+    def _box_fractions(box_dict):
+        volume_fraction = box_dict['tumor_volume_fraction']
+        blood_volume_fraction = volume_fraction * box_dict['relative_blood_density']
+        blood_flow_fraction = volume_fraction * box_dict['relative_perfusion']
+        return blood_volume_fraction, blood_flow_fraction
+
+    def split_box_parallel(self, name, box_dict):
+        blood_volume_fraction, blood_flow_fraction = self._box_fractions(box_dict)
+        self._split_box(name, box_dict['tumor_site'], blood_volume_fraction, blood_flow_fraction)
+        self._update_rates()
+
+    def split_boxes_parallel(self, boxes):
+        """
+        Add several boxes in a single model update (rates and MTTs are recomputed only once).
+        boxes : dict of {name: box_dict}, every box_dict having the same keys as for split_box_parallel
+                ('tumor_site', 'tumor_volume_fraction', 'relative_blood_density' and 'relative_perfusion').
+                Multiple boxes can share a site; their fractions are all relative to the original site.
+        Note that compartments are later matched to organs by name, so box names should not contain organ names.
+        """
+        # fractions of the original sites that have already been carved out:
+        taken = {}
+        for name, box_dict in boxes.items():
+            site = box_dict['tumor_site']
+            blood_volume_fraction, blood_flow_fraction = self._box_fractions(box_dict)
+            taken_volume, taken_flow = taken.get(site, (0.0, 0.0))
+            assert (taken_volume + blood_volume_fraction < 1.0), \
+                'Cannot steal more than 100% of the original simulation volume of {}.'.format(site)
+            assert (taken_flow + blood_flow_fraction < 1.0), \
+                'Cannot steal more than 100% of the original flow of {}.'.format(site)
+            # convert to fractions of what is left of the site:
+            self._split_box(name, site, blood_volume_fraction / (1 - taken_volume),
+                            blood_flow_fraction / (1 - taken_flow))
+            taken[site] = (taken_volume + blood_volume_fraction, taken_flow + blood_flow_fraction)
+        self._update_rates()
+
+
+class FlowModelFactory:
+    """
+    For cohort studies: read and compile the base model of every sheet (e.g. male and female) only once,
+    and produce patient-specific models by rescaling to the patient's TBV and CO and adding the tumor boxes.
+    """
+    def __init__(self, filename, simulation_params, sheet_names=('male_new', 'female_new')):
+        self.base_models = {}
+        for sheet_name in sheet_names:
+            # compile at unit TBV (L) and CO (L/s); rescaled per patient.
+            reference_params = {'sheet_name': sheet_name, 'TBV': 1.0, 'CO': 1.0}
+            self.base_models[sheet_name] = ExpandFlowModel(filename, reference_params, simulation_params)
+
+    @staticmethod
+    def get_boxes(patient_params):
+        """
+        The tumor (if it is one of the organs) and any additional lesion/nodal boxes of the patient.
+        """
+        boxes = {'tumor': patient_params} if 'tumor' in patient_params['organs'] else {}
+        boxes.update(patient_params['boxes'])
+        return boxes
+
+    def create(self, patient_params):
+        base = self.base_models[patient_params['sheet_name']]
+        # share what does not change, copy what does:
+        model = copy.copy(base)
+        model.names = list(base.names)
+        model.volumes = base.volumes.copy()
+        model.flows = base.flows.copy()
+        model.cum_volume = base.cum_volume.copy()
+        model.k_matrix = base.k_matrix.copy()
+        model.mtt = base.mtt.copy()
+        model.G = base.G.copy()
+        model.rescale(patient_params['TBV'], patient_params['CO'])
+
+        boxes = self.get_boxes(patient_params)
+        if boxes:
+            model.split_boxes_parallel(boxes)
+        return model
@@ -1,11 +1,14 @@
 import copy
+import json
 import os
+from collections.abc import Mapping
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
 from scipy.ndimage import gaussian_filter, binary_dilation
 
 from PlotDoseDistribution import plot_volumes
+from LabelmapUtils import labelmap_dtype
 
 
 def vol_to_gridpoints(vol, affine):
@@ -39,6 +42,113 @@ def vol_to_gridpoints(vol, affine):
 #     return sample_dose
 
 
+class SegmentationStore(Mapping):
+    """
+    Per-organ segmentations as written by dicom_conversion.save_segmentation_store: one .npy file per organ,
+    cropped to its bounding box, and a manifest (segs.json) with the organ order, file names and bounding boxes.
+    Files are memory-mapped, so only organs that are looked up are read from disk (get_cropped avoids creating
+    the full-size array). Fractional stores hold partial-volume fractions, returned as float32 in [0, 1].
+    Stores written before organs were cropped (full-size files named after the organs) are read as well.
+    """
+    def __init__(self, seg_dir):
+        self.seg_dir = seg_dir
+        with open(os.path.join(seg_dir, 'segs.json')) as f:
+            manifest = json.load(f)
+        # same attribute as np.load of a .npz file: the organs in file order.
+        self.files = manifest['organs']
+        self.file_names = manifest.get('files', {organ_name: organ_name + '.npy' for organ_name in self.files})
+        self.bboxes = manifest.get('bboxes')
+        self.shape = tuple(manifest['shape']) if manifest['shape'] is not None else None
+        self.packed = manifest['packed']
+        self.fractional = manifest.get('fractional', False)
+
+    def get_cropped(self, organ_name):
+        """
+        The segmentation of an organ cropped to its bounding box, as (bbox, cropped segmentation)
+        with bbox a tuple of slices into the full shape; (None, None) for an empty organ.
+        """
+        if organ_name not in self.files:
+            raise KeyError(organ_name)
+        if self.bboxes is None:
+            bbox = tuple(slice(0, n) for n in self.shape)
+        elif self.bboxes[organ_name] is None:
+            return None, None
+        else:
+            bbox = tuple(slice(start, stop) for start, stop in self.bboxes[organ_name])
+        crop_shape = tuple(b.stop - b.start for b in bbox)
+        seg = np.load(os.path.join(self.seg_dir, self.file_names[organ_name]), mmap_mode='r')
+        if self.packed:
+            seg = np.unpackbits(seg, count=int(np.prod(crop_shape))).reshape(crop_shape)
+        if self.fractional:
+            seg = seg.astype(np.float32) / 255
+        return bbox, seg
+
+    def __getitem__(self, organ_name):
+        bbox, cropped = self.get_cropped(organ_name)
+        if self.bboxes is None:
+            return cropped
+        seg = np.zeros(self.shape, dtype=np.float32 if self.fractional else np.uint8)
+        if bbox is not None:
+            seg[bbox] = cropped
+        return seg
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+
+def open_segmentations(read_dir):
+    """
+    Open the segmentations of a patient directory without reading them:
+    either a per-organ store (read_dir/segs) or a single compressed archive (read_dir/compressed_segs.npz).
+    """
+    seg_dir = os.path.join(read_dir, 'segs')
+    if os.path.isfile(os.path.join(seg_dir, 'segs.json')):
+        return SegmentationStore(seg_dir)
+    npz_path = os.path.join(read_dir, 'compressed_segs.npz')
+    if os.path.isfile(npz_path):
+        return np.load(npz_path)
+    raise ValueError("Segmentation files not found in {}".format(read_dir))
+
+
+def labelmap_histograms(values, labels, n_labels, bins, weights=None):
+    """
+    Histograms of the values of all labels at once: a single np.bincount over (label, bin) pairs.
+    Follows np.histogram: all bins are half-open except the last one, values outside the bins are ignored.
+    With weights (e.g. partial-volume fractions), every value counts with its weight.
+    returns counts of shape (n_labels + 1, n_bins), the first row being the background.
+    """
+    n_bins = len(bins) - 1
+    bin_idx = np.searchsorted(bins, values, side='right') - 1
+    bin_idx[values == bins[-1]] = n_bins - 1
+    inside = (bin_idx >= 0) & (bin_idx < n_bins)
+    counts = np.bincount(labels[inside].astype(np.int64) * n_bins + bin_idx[inside],
+                         weights=None if weights is None else weights[inside], minlength=(n_labels + 1) * n_bins)
+    return counts.reshape(n_labels + 1, n_bins)
+
+
+class OrganMasks(Mapping):
+    """
+    Read-only dict of organ masks backed by a single labelmap (label i + 1 for the i-th organ, 0 for background).
+    A boolean mask is only created when an organ is looked up.
+    """
+    def __init__(self, labels, organ_names):
+        self.labels = labels
+        self.organ_names = list(organ_names)
+        self.label_values = {organ_name: i + 1 for i, organ_name in enumerate(self.organ_names)}
+
+    def __getitem__(self, organ_name):
+        return self.labels == self.label_values[organ_name]
+
+    def __iter__(self):
+        return iter(self.organ_names)
+
+    def __len__(self):
+        return len(self.organ_names)
+
+
 class Patient:
     """
     Here we load the dose and segmentations simply as numpy files.
@@ -50,20 +160,35 @@ class Patient:
         self.gridpoints = None
         self.dose = None
         self.tumor_volume_fraction = None
+        # organs are held in a single labelmap; seg_organs gives (lazy) boolean masks per organ.
+        self.labels = None
         self.seg_organs = {}
+        # fractional segmentations: the part of each voxel belonging to its label (voxel_weights), and the
+        # parts belonging to other organs as (flat voxel index, label, weight) arrays (partial_voxels).
+        self.voxel_weights = None
+        self.partial_voxels = None
+        # per-organ dose statistics, computed in one pass over the dose grid when first needed:
+        self.organ_stats = None
+        # cropping (see crop_to_dose): the affine includes the offset of the cropped arrays.
+        self.affine = None
+        self.dose_max = None
+        self.crop_offset = np.zeros(3, dtype=int)
+        self.outside_voxel_counts = None
+        # per-beam doses (see dicom_conversion, a list of RTDOSE files): read from beam_dir when first needed.
+        self.beam_dir = None
+        self.beam_names = []
+        self.beam_stats = {}
 
     def read_from_numpy(self, read_dir, organ_names, plot=True):
         """
-        Read in segmentations which are assumed to be bundled in a .npz files.
+        Read in segmentations, either stored per organ (memory-mapped, only the requested organs are read)
+        or bundled in a .npz file.
         Read in dose (or create one artificially, just as an example).
         Read in an affine transform which defines the coordinates of the voxels of the numpy arrays.
+        Per-beam doses (beam_doses/) are only looked up, they are read when first needed (see get_beam_dose).
 
         This could/should be replaced by your own function, potentially reading in DICOM files of patients directly.
         """
-        segs_loaded = np.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../input/patient/compressed_segs.npz"))
-        self.seg_organs = {organ_name: seg for organ_name, seg in segs_loaded.items() if organ_name in organ_names}
-        self._remove_overlap()
-
         if os.path.isfile(os.path.join(read_dir, 'dose.npy')):
             self.dose = np.load(os.path.join(read_dir, 'dose.npy'))
         else:
@@ -71,55 +196,297 @@ class Patient:
         #else:
             #print('Dose file not found, creating sample dose')
         #self.dose = create_sample_dose(segs_loaded['tumor'])
-        affine = np.load(os.path.join(read_dir, 'affine.npy'))
-        self.gridpoints = vol_to_gridpoints(self.dose, affine)
+        self.dose_max = np.max(self.dose)
+        self.affine = np.load(os.path.join(read_dir, 'affine.npy'))
+        self.gridpoints = vol_to_gridpoints(self.dose, self.affine)
+        self.crop_offset = np.zeros(3, dtype=int)
+        self.outside_voxel_counts = None
+        self.beam_dir = None
+        self.beam_names = []
+        self.beam_stats = {}
+        beams_path = os.path.join(read_dir, 'beam_doses', 'beams.json')
+        if os.path.isfile(beams_path):
+            with open(beams_path) as f:
+                self.beam_names = json.load(f)['beams']
+            self.beam_dir = os.path.dirname(beams_path)
+
+        segs_loaded = open_segmentations(read_dir)
+        self._build_labelmap(segs_loaded, [organ_name for organ_name in segs_loaded.files if organ_name in organ_names])
+
+        # organs converted onto the dose grid: the voxels that fell outside of it (see dicom_conversion)
+        outside_path = os.path.join(read_dir, 'outside_voxels.json')
+        if os.path.isfile(outside_path):
+            with open(outside_path) as f:
+                outside_voxels = json.load(f)
+            self.outside_voxel_counts = np.array(
+                [0] + [outside_voxels.get(organ_name, 0) for organ_name in self.seg_organs.organ_names]
+            )
+            if self.voxel_weights is None:
+                self.outside_voxel_counts = np.rint(self.outside_voxel_counts).astype(np.int64)
 
         if plot:
-            one_hot = np.stack(list(self.seg_organs.values()), axis=-1)
-            one_hot = np.concatenate([np.zeros_like(one_hot[..., 0][..., None]), one_hot], axis=-1)
-            labels = np.argmax(one_hot, axis=-1).astype(float)
-            labels /= np.amax(labels)
+            labels = self.labels.astype(float)
+            labels /= max(np.amax(labels), 1)
             plot_volumes(self.dose, labels, cmap='viridis', scrollable=True)
 
-    def _remove_overlap(self):
+    def _build_labelmap(self, segs, organ_names):
         """
         Segmentations might be overlapping. Remove this overlap, otherwise we will count dose twice.
-        The order determines the hierarchy with its members going from low to high priority.
+        The order determines the hierarchy with its members going from low to high priority:
+        each organ simply overwrites the labels of the ones before it, in a single pass.
+        Fractional segmentations are split instead: going from high to low priority, each organ gets its
+        fraction of what is left of the voxel (see _build_fractional_labelmap).
+        """
+        self.labels = np.zeros(self.dose.shape, dtype=labelmap_dtype(len(organ_names)))
+        self.voxel_weights = None
+        self.partial_voxels = None
+        if getattr(segs, 'fractional', False):
+            self._build_fractional_labelmap(segs, organ_names)
+        else:
+            for label, organ_name in enumerate(organ_names, start=1):
+                if hasattr(segs, 'get_cropped'):
+                    bbox, cropped = segs.get_cropped(organ_name)
+                    if bbox is not None:
+                        self.labels[bbox][cropped > 0.5] = label
+                else:
+                    self.labels[segs[organ_name] > 0.5] = label
+        self.seg_organs = OrganMasks(self.labels, organ_names)
+        self.organ_stats = None
+        self.beam_stats = {}
+
+    def _build_fractional_labelmap(self, segs, organ_names):
+        """
+        Each voxel is labelled with the organ holding the largest part of it (the higher priority one on ties),
+        which gives the organ masks; that part is kept in voxel_weights, the parts of the other organs
+        in partial_voxels. All statistics are weighted with these parts.
+        """
+        labels = self.labels.ravel()
+        weights = np.zeros(labels.shape, dtype=np.float32)
+        remaining = np.ones(labels.shape, dtype=np.float32)
+        partial = []
+        for label in range(len(organ_names), 0, -1):
+            fractions = np.asarray(segs[organ_names[label - 1]], dtype=np.float32).ravel()
+            idx = np.flatnonzero(fractions > 0)
+            part = np.minimum(fractions[idx], remaining[idx])
+            idx, part = idx[part > 0], part[part > 0]
+            remaining[idx] -= part
+
+            larger = part > weights[idx]
+            replaced = idx[larger][labels[idx[larger]] > 0]
+            partial.append((replaced, labels[replaced], weights[replaced]))
+            partial.append((idx[~larger], np.full((~larger).sum(), label), part[~larger]))
+            labels[idx[larger]] = label
+            weights[idx[larger]] = part[larger]
+
+        self.voxel_weights = weights.reshape(self.labels.shape)
+        self.partial_voxels = tuple(
+            np.concatenate([p[i] for p in partial]).astype(dtype)
+            for i, dtype in enumerate((np.int64, self.labels.dtype, np.float32))
+        )
+
+    def _label_counts(self):
+        """
+        (Weighted) number of voxels per label value, including the partial voxels of fractional segmentations.
+        """
+        n_labels = len(self.seg_organs)
+        if self.voxel_weights is None:
+            return np.bincount(self.labels.ravel(), minlength=n_labels + 1)
+        _, partial_labels, partial_weights = self.partial_voxels
+        return (np.bincount(self.labels.ravel(), weights=self.voxel_weights.ravel(), minlength=n_labels + 1)
+                + np.bincount(partial_labels, weights=partial_weights, minlength=n_labels + 1))
+
+    def crop_to_dose(self, threshold=0.01, margin=1):
+        """
+        Crop the dose and the organs to the bounding box (plus a margin) of the organ voxels receiving more than
+        threshold (Gy), so that all downstream calculations only deal with the irradiated region.
+        The offset is kept in the affine (and crop_offset), the gridpoints are cropped accordingly.
+        Organ voxels outside the box receive at most the threshold dose; they are still counted in the organ
+        statistics (as zero dose, i.e. in the first bin) and can be accounted for with get_outside_fraction.
+        """
+        region = (self.dose > threshold) & (self.labels > 0)
+        if not np.any(region):
+            print('No organ voxels above {} Gy, nothing to crop.'.format(threshold))
+            return
+        lo = np.zeros(3, dtype=int)
+        hi = np.array(self.dose.shape)
+        for axis in range(3):
+            idx = np.where(np.any(region, axis=tuple(a for a in range(3) if a != axis)))[0]
+            lo[axis] = max(idx[0] - margin, 0)
+            hi[axis] = min(idx[-1] + 1 + margin, self.dose.shape[axis])
+        crop = tuple(slice(lo[axis], hi[axis]) for axis in range(3))
+
+        full_counts = self._label_counts()
+        full_size = self.dose.size
+        if self.partial_voxels is not None:
+            idx, partial_labels, partial_weights = self.partial_voxels
+            voxels = np.stack(np.unravel_index(idx, self.labels.shape), axis=1)
+            inside = np.all((voxels >= lo) & (voxels < hi), axis=1)
+            idx = np.ravel_multi_index(tuple((voxels[inside] - lo).T), tuple(hi - lo))
+            self.partial_voxels = (idx, partial_labels[inside], partial_weights[inside])
+            self.voxel_weights = np.ascontiguousarray(self.voxel_weights[crop])
+        self.dose = np.ascontiguousarray(self.dose[crop])
+        self.labels = np.ascontiguousarray(self.labels[crop])
+        self.seg_organs = OrganMasks(self.labels, self.seg_organs.organ_names)
+        outside = full_counts - self._label_counts()
+        outside[0] = 0
+        if self.outside_voxel_counts is not None:
+            outside += self.outside_voxel_counts
+        self.outside_voxel_counts = outside
+
+        self.gridpoints = tuple(self.gridpoints[axis][crop[axis]] for axis in range(3))
+        self.affine = self.affine.copy()
+        self.affine[:3, 3] += self.affine[:3, :3] @ lo
+        self.crop_offset = self.crop_offset + lo
+        self.organ_stats = None
+        self.beam_stats = {}
+        print('Cropped to {} voxels ({:.1f}% of the original grid).'.format(
+            self.dose.shape, 100 * self.dose.size / full_size))
+
+    def get_voxel_spacing(self):
+        """
+        Voxel spacing along the axes of the gridpoints (from the affine, so also for axes cropped to a single voxel).
+        """
+        return np.linalg.norm(self.affine[:3, :3], axis=0)
+
+    def get_organ_voxel_count(self, organ_name):
+        """
+        Number of voxels of the organ (including those cropped away).
         """
-        for i, (organ_name, seg) in enumerate(self.seg_organs.items()):
-            seg = (seg > 0.5).astype(int)
-            if i < (len(self.seg_organs) - 1):
-                mask = (sum(list(self.seg_organs.values())[i + 1:]) > 0.5).astype(int)
-                mask = (seg + mask == 2).astype(int)
-                seg -= mask
-            self.seg_organs[organ_name] = seg.astype(bool)
+        return self._get_organ_stats()['voxel_counts'][self.seg_organs.label_values[organ_name]]
+
+    def get_outside_fraction(self, organ_name):
+        """
+        Fraction of the organ that was cropped away (see crop_to_dose).
+        """
+        if self.outside_voxel_counts is None:
+            return 0.0
+        outside = self.outside_voxel_counts[self.seg_organs.label_values[organ_name]]
+        return outside / max(self.get_organ_voxel_count(organ_name), 1)
 
     def get_tumor_volume_fraction(self, tumor_bearing_organ, tumor):
         """
         This function gets the volume fraction of the tumor with respect to the organ in which it resides.
         """
-        self.tumor_volume_fraction = np.sum(self.seg_organs[tumor]) / np.sum(self.seg_organs[tumor_bearing_organ])
+        self.tumor_volume_fraction = self.get_organ_voxel_count(tumor) / self.get_organ_voxel_count(tumor_bearing_organ)
         print('Tumor volume fraction = {:.4f}'.format(self.tumor_volume_fraction))
 
+    def compute_organ_statistics(self):
+        """
+        Voxel counts, mean doses and dose histograms (0.1 Gy bins) of all organs in a single scan of the dose grid.
+        The results are cached; DVHs and dose rate histograms are derived from them.
+        Voxels cropped away (see crop_to_dose) are included as zero dose.
+        With fractional segmentations, voxels count with the part of them belonging to the organ
+        (so voxel counts and histograms are not integers).
+        """
+        self.organ_stats = self._dose_statistics(self.dose, self.dose_max)
+        return self.organ_stats
+
+    def _dose_statistics(self, dose, dose_max=None):
+        """
+        Organ statistics (see compute_organ_statistics) of a dose on the grid of the patient.
+        """
+        in_organ = self.labels > 0
+        labels = self.labels[in_organ]
+        organ_dose = dose[in_organ]
+        weights = None
+        if self.voxel_weights is not None:
+            idx, partial_labels, partial_weights = self.partial_voxels
+            labels = np.concatenate([labels, partial_labels])
+            organ_dose = np.concatenate([organ_dose, dose.ravel()[idx]])
+            weights = np.concatenate([self.voxel_weights[in_organ], partial_weights]).astype(np.float64)
+        n_labels = len(self.seg_organs)
+        dose_max = np.max(dose) if dose_max is None else dose_max
+        bins = np.arange(0, np.ceil(dose_max) + 0.1, 0.1)
+        stats = {
+            'voxel_counts': np.bincount(labels, weights=weights, minlength=n_labels + 1),
+            'dose_sums': np.bincount(labels, weights=organ_dose if weights is None else organ_dose * weights,
+                                     minlength=n_labels + 1),
+            'dose_bins': bins,
+            'dose_hists': labelmap_histograms(organ_dose, labels, n_labels, bins, weights=weights),
+        }
+        if self.outside_voxel_counts is not None:
+            stats['voxel_counts'] = stats['voxel_counts'] + self.outside_voxel_counts
+            stats['dose_hists'][:, 0] += self.outside_voxel_counts
+        return stats
+
+    def _get_organ_stats(self):
+        if self.organ_stats is None:
+            self.compute_organ_statistics()
+        return self.organ_stats
+
     def get_mean_organ_dose(self, organ_name):
         """
         This function calculates the mean organ dose.
         """
-        idx = np.where(self.seg_organs[organ_name] == 1)
-        mod = np.mean(self.dose[idx[0], idx[1], idx[2]])
-        return mod
+        return self.get_mean_organ_doses([organ_name])[0]
+
+    def get_mean_organ_doses(self, organ_names):
+        """
+        Mean doses of multiple organs (array).
+        """
+        stats = self._get_organ_stats()
+        label_values = [self.seg_organs.label_values[organ_name] for organ_name in organ_names]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return stats['dose_sums'][label_values] / stats['voxel_counts'][label_values]
+
+    def get_dose_histogram(self, organ_name):
+        """
+        Returns the voxel counts per dose bin of the organ, and the dose bins (Gy).
+        """
+        stats = self._get_organ_stats()
+        return stats['dose_hists'][self.seg_organs.label_values[organ_name]], stats['dose_bins']
+
+    def get_beam_dose(self, beam_name):
+        """
+        Dose of a single beam, on the (cropped) grid of the patient dose.
+        """
+        if beam_name not in self.beam_names:
+            raise KeyError(beam_name)
+        beam_dose = np.load(os.path.join(self.beam_dir, beam_name + '.npy'), mmap_mode='r')
+        crop = tuple(slice(self.crop_offset[axis], self.crop_offset[axis] + self.dose.shape[axis]) for axis in range(3))
+        return np.array(beam_dose[crop], dtype=np.float32)
+
+    def get_beam_dose_histogram(self, organ_name, beam_name):
+        """
+        Returns the voxel counts per dose bin of the organ for a single beam, and the dose bins (Gy).
+        The statistics of a beam are computed (in one pass, for all organs) when first needed.
+        """
+        if beam_name not in self.beam_stats:
+            self.beam_stats[beam_name] = self._dose_statistics(self.get_beam_dose(beam_name))
+        stats = self.beam_stats[beam_name]
+        return stats['dose_hists'][self.seg_organs.label_values[organ_name]], stats['dose_bins']
+
+    def match_beam_names(self, beam_names):
+        """
+        Checks the beam names of the fields of a treatment (see Treatment_parameters) against the per-beam doses.
+        Returns them, or None (spread the total dose over all fields) if no beam names are given.
+        """
+        if beam_names is None:
+            if self.beam_names:
+                print('Warning: no beam names given, the per-beam doses ({}) are not used.'.format(
+                    ', '.join(self.beam_names)))
+            return None
+        missing = [beam_name for beam_name in beam_names if beam_name not in self.beam_names]
+        if missing:
+            raise ValueError('No per-beam dose for beams {} (available: {}).'.format(
+                ', '.join(missing), ', '.join(self.beam_names) or 'none'))
+        return list(beam_names)
+
+    def get_dvh(self, organ_name):
+        """
+        Returns the dose bins (Gy) and the coverage (%) of the organ.
+        """
+        values, bins = self.get_dose_histogram(organ_name)
+        coverage = np.append(np.cumsum(values[::-1])[::-1] / self.get_organ_voxel_count(organ_name) * 100, [0])
+        return bins, coverage
 
     def write_dvh(self, save_dir, organ_names):
         """
         Summarize fields into DVHs of each organ separately. Write out in csv-files.
         This representation can also be used for blood dose calculation.
         """
-        bins = np.arange(0, np.ceil(np.max(self.dose)) + 0.1, 0.1)
         for organ_name in organ_names:
-            idx = np.where(self.seg_organs[organ_name] == 1)
-            organ_dose = self.dose[idx[0], idx[1], idx[2]]
-            values, bins = np.histogram(organ_dose, bins=bins)
-            coverage = np.append(np.cumsum(values[::-1])[::-1] / organ_dose.size * 100, [0])
+            bins, coverage = self.get_dvh(organ_name)
             dvh = np.stack([bins, coverage], axis=1)
             # save
             pd.DataFrame(dvh).to_csv(os.path.join(save_dir, organ_name + '_DVH.csv'), header=['dose_bins', 'coverage'])
@@ -128,4 +495,3 @@ class Patient:
         plt.xlabel('Dose (Gy)')
         plt.ylabel('Coverage (%)')
         plt.show()
-
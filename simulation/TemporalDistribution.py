@@ -17,7 +17,7 @@ class TemporalDistribution:
         """
         t = time.process_time()
         compartment_id = self.model.cum_volume.searchsorted(
-            np.random.uniform(size=self.model.sample_size)).astype(np.uint8)
+            np.random.uniform(size=self.model.sample_size)).astype(self.model.chain.dtype)
         self.path = self.model.chain.walk(self.model.nr_steps, compartment_id)
         print(f'Time to generate simulation distribution: {time.process_time()-t:.6f} seconds')
 
@@ -27,18 +27,40 @@ class TemporalDistribution:
         """
         start_time = time.process_time()
         compartment_id = self.model.cum_volume.searchsorted(
-            np.random.uniform(size=self.model.sample_size)).astype(np.uint8)
-        self.path = self.model.chain.walk_v1(self.model.nr_steps, compartment_id)
+            np.random.uniform(size=self.model.sample_size)).astype(self.model.chain.dtype)
+        if self.model.chain.multi_rate:
+            self.path = self.model.chain.walk_multi_rate(self.model.nr_steps, compartment_id)
+        else:
+            self.path = self.model.chain.walk_v1(self.model.nr_steps, compartment_id)
         # self.path = self.model.chain.walk_v2(self.model.nr_steps, compartment_id)
         print(f'Time to generate temporal distribution: {time.process_time()-start_time:.2f} seconds')
 
+    def check_steady_state(self, tolerance=0.1):
+        """
+        Check a generated path: the walk starts in equilibrium, so the mean occupancy of every compartment should stay
+        at its volume fraction (e.g. to validate a time step with the multi-rate walk).
+        Compartments deviating by more than tolerance (relative) are reported; those holding too few particles
+        to tell (a deviation of tolerance would be within 3 standard errors) are not checked.
+        returns the occupancy divided by the volume fraction, per compartment.
+        """
+        n_compartments = len(self.model.names)
+        occupancy = np.bincount(self.path.ravel(), minlength=n_compartments)[:n_compartments] / self.path.size
+        volume_fractions = self.model.volumes / np.sum(self.model.volumes)
+        ratios = occupancy / volume_fractions
+        checked = volume_fractions * self.path.shape[0] * tolerance**2 > 9
+        for name, ratio in zip(np.array(self.model.names)[checked], ratios[checked]):
+            if abs(ratio - 1) > tolerance:
+                print(f'Warning: occupancy of {name} is {ratio:.2f} times its volume fraction (not in steady state).')
+        return ratios
+
     def temporal_volume(self):
         """
         Calculate volume changes in time. # of BP x # of time-steps
         """
         start_time = time.process_time()
-        self.tv = np.apply_along_axis(lambda x: np.bincount(x, minlength=256), axis=0, arr=self.path)
-        self.tv = self.tv[:len(self.model.names)] / self.model.sample_size
+        n_compartments = len(self.model.names)
+        self.tv = np.apply_along_axis(lambda x: np.bincount(x, minlength=n_compartments), axis=0, arr=self.path)
+        self.tv = self.tv[:n_compartments] / self.model.sample_size
         print(f'Time to get temporal volumes: {time.process_time() - start_time:.2f} seconds')
 
     def save(self, f_name):
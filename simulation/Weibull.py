@@ -100,3 +100,12 @@ class Weibull:
         p = self.hf(t) * dt
         return np.where(p > random_numbers)[0]
 
+    def residual_time(self, t):
+        """
+        t : an array of residence times.
+        returns the (random) remaining times until the particles leave, drawn from the transit time distribution
+        conditional on T >= t by inverting S(t + tau) / S(t) = U, with U uniform on (0, 1].
+        """
+        random_numbers = 1.0 - np.random.uniform(size=t.size)
+        return self.scale * ((t / self.scale)**self.shape - np.log(random_numbers))**(1.0 / self.shape) - t
+
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 from simulation.Weibull import Weibull
 from simulation.Chains import Chain, MarkovChain
-from simulation.FlowModel import ExpandFlowModel
+from simulation.FlowModel import ExpandFlowModel, FlowModelFactory
 from simulation.TemporalDistribution import TemporalDistribution
 from simulation.CompartmentDose import CompartmentDose
+from simulation.AnalyticalDose import AnalyticalDose
 from simulation.DoseRate import DoseRate, DoseRateFromDVH
 from simulation.LoadPatient import Patient
 
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+
+from simulation import ExpandFlowModel, TemporalDistribution, CompartmentDose, AnalyticalDose
+
+MODEL_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'input', 'phantom', 'ICRP89_compartment_model.xlsx')
+
+
+@pytest.fixture(scope='module')
+def markov_path():
+    # exponential transit times (Weibull shape 1), for which the analytical variance holds as well:
+    simulation_params = {'sample_size': 20000, 'nr_steps': 1200, 'dt': 0.05, 'weibull_shape': 1}
+    patient_params = {'sheet_name': 'male_new', 'TBV': 5.3, 'CO': 6.5 / 60}
+    model = ExpandFlowModel(MODEL_FILE, patient_params, simulation_params)
+    model.construct_markov()
+    np.random.seed(0)
+    blood = TemporalDistribution(model)
+    blood.generate_from_markov()
+    return model, blood.path
+
+
+@pytest.mark.parametrize('dose_rate', [1.0, (np.array([1., 1., 2.]), np.array([0., 1., 2., 3.]))],
+                         ids=['homogeneous', 'histogram'])
+def test_moments_match_monte_carlo(markov_path, dose_rate):
+    model, path = markov_path
+    compartment_ids = [i for i, name in enumerate(model.names) if 'lung' in name]
+    simulated = CompartmentDose(path, model.dt)
+    analytical = AnalyticalDose(model)
+    for start_time, beam_on_time in [(5, 30), (40, 10)]:
+        simulated.add_dose(dose_rate, compartment_ids, start_time=start_time, beam_on_time=beam_on_time)
+        analytical.add_dose(dose_rate, compartment_ids, start_time=start_time, beam_on_time=beam_on_time)
+    mean, std = analytical.solve()
+
+    assert mean == pytest.approx(simulated.dose.mean(), rel=0.03)
+    assert std == pytest.approx(simulated.dose.std(), rel=0.05)
+
+
+def test_repeat_scales_moments(markov_path):
+    model, _ = markov_path
+    analytical = AnalyticalDose(model)
+    analytical.add_dose(1.0, [model.names.index('lung')], start_time=0, beam_on_time=30)
+    mean, std = analytical.solve()
+    analytical.repeat(5)
+    assert analytical.mean == pytest.approx(5 * mean)
+    assert analytical.var == pytest.approx(5 * std ** 2)
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+# the DICOM_file_handling package needs torch (TotalSegmentator)
+pytest.importorskip('torch')
+from DICOM_file_handling.Functions.batch_conversion import read_manifest, parse_option  # noqa: E402
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('true', True), ('FALSE', False), (' True ', True),
+    ('4', 4), ('0.5', 0.5), ('-1', -1),
+    ('{"lungs": ["lung_left", "lung_right"]}', {'lungs': ['lung_left', 'lung_right']}),
+    ('["a", "b"]', ['a', 'b']),
+    ('dose', 'dose'), ('packed', 'packed'),
+])
+def test_parse_option(value, expected):
+    parsed = parse_option(value)
+    assert parsed == expected
+    assert type(parsed) is type(expected)
+
+
+def test_read_csv_manifest(tmp_path):
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text(
+        'patient,plan,CT,RTSTRUCT,RTDOSE,grid,fractional,supersampling,n_workers,groups\n'
+        '001,1,ct/001,rs.dcm,beam_1.dcm; beam_2.dcm,dose,true,4,2,"{""lungs"": [""lung_l"", ""lung_r""]}"\n'
+        '002,A,ct/002,rs2.dcm,rd.dcm,,false,,,\n'
+    )
+    first, second = read_manifest(str(manifest))
+
+    # identifiers and paths stay strings (e.g. leading zeros are kept):
+    assert first['patient'] == '001' and first['plan'] == '1'
+    assert first['RTDOSE'] == ['beam_1.dcm', 'beam_2.dcm']
+    assert first['grid'] == 'dose'
+    assert first['fractional'] is True
+    assert first['supersampling'] == 4 and first['n_workers'] == 2
+    assert first['groups'] == {'lungs': ['lung_l', 'lung_r']}
+    # empty cells are left out, so the conversion defaults apply:
+    assert second == {'patient': '002', 'plan': 'A', 'CT': 'ct/002', 'RTSTRUCT': 'rs2.dcm', 'RTDOSE': 'rd.dcm',
+                      'fractional': False}
+
+
+def test_read_json_manifest(tmp_path):
+    entries = [{'patient': 1, 'plan': 2, 'CT': 'ct', 'SEGMENTATIONS': ['a.nii.gz'], 'RTDOSE': 'rd.dcm',
+                'fractional': True}]
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps(entries))
+    assert read_manifest(str(manifest)) == entries
+    assert read_manifest(entries) == entries
+
+
+@pytest.mark.parametrize('entries', [
+    [{'patient': '1', 'plan': '1', 'CT': 'ct', 'RTSTRUCT': 'rs.dcm'}],
+    [{'patient': '1', 'plan': '1', 'CT': 'ct', 'RTDOSE': 'rd.dcm'}],
+    [{'patient': '1', 'plan': '1', 'CT': 'ct', 'RTSTRUCT': 'rs.dcm', 'RTDOSE': 'rd.dcm'}] * 2,
+], ids=['no RTDOSE', 'no structures', 'duplicate'])
+def test_invalid_manifest(entries):
+    with pytest.raises(ValueError):
+        read_manifest(entries)
@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+
+from simulation import ExpandFlowModel, FlowModelFactory
+
+MODEL_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'input', 'phantom', 'ICRP89_compartment_model.xlsx')
+SIMULATION_PARAMS = {'sample_size': 1000, 'nr_steps': 100, 'dt': 0.05, 'weibull_shape': 2}
+
+
+def patient_params(organs, boxes=None):
+    return {'sheet_name': 'female_new', 'TBV': 4.2, 'CO': 6.1 / 60, 'organs': organs,
+            'tumor_site': 'lung', 'tumor_volume_fraction': 0.05,
+            'relative_blood_density': 1.2, 'relative_perfusion': 0.8, 'boxes': boxes or {}}
+
+
+@pytest.fixture(scope='module')
+def factory():
+    return FlowModelFactory(MODEL_FILE, SIMULATION_PARAMS, sheet_names=['female_new'])
+
+
+def assert_same_model(model, expected):
+    assert model.names == expected.names
+    np.testing.assert_allclose(model.volumes, expected.volumes)
+    np.testing.assert_allclose(model.flows, expected.flows)
+    np.testing.assert_allclose(model.cum_volume, expected.cum_volume)
+    np.testing.assert_allclose(model.mtt, expected.mtt)
+    np.testing.assert_allclose(model.get_ordered_rate_matrix(), expected.get_ordered_rate_matrix(), rtol=1e-6)
+    assert model.particle_volume == pytest.approx(expected.particle_volume)
+
+
+def test_create_with_tumor(factory):
+    params = patient_params(['lung', 'tumor'])
+    expected = ExpandFlowModel(MODEL_FILE, params, SIMULATION_PARAMS)
+    expected.split_box_parallel('tumor', params)
+    assert_same_model(factory.create(params), expected)
+
+
+def test_create_with_boxes(factory):
+    boxes = {'node_1': {'tumor_site': 'lung', 'tumor_volume_fraction': 0.02,
+                        'relative_blood_density': 1.0, 'relative_perfusion': 1.0},
+             'metastasis': {'tumor_site': 'liver', 'tumor_volume_fraction': 0.03,
+                            'relative_blood_density': 1.0, 'relative_perfusion': 1.5}}
+    params = patient_params(['lung', 'liver', 'tumor'], boxes)
+    expected = ExpandFlowModel(MODEL_FILE, params, SIMULATION_PARAMS)
+    expected.split_boxes_parallel(dict({'tumor': params}, **boxes))
+    assert_same_model(factory.create(params), expected)
+
+
+def test_create_does_not_change_the_base_model(factory):
+    base = factory.base_models['female_new']
+    names, k_matrix = list(base.names), base.k_matrix.copy()
+    factory.create(patient_params(['lung', 'tumor']))
+    assert base.names == names
+    np.testing.assert_array_equal(base.k_matrix, k_matrix)
@@ -0,0 +1,94 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from simulation.LoadPatient import SegmentationStore, open_segmentations
+
+# the conversion functions come with the DICOM_file_handling package, which needs torch (TotalSegmentator)
+pytest.importorskip('torch')
+sitk = pytest.importorskip('SimpleITK')
+from DICOM_file_handling.Functions.dicom_conversion import save_hedos_inputs  # noqa: E402
+
+SHAPE = (12, 10, 6)  # (row, col, z), the layout of the saved dose
+
+
+def grid_image():
+    image = sitk.GetImageFromArray(np.arange(np.prod(SHAPE), dtype=np.float32).reshape(SHAPE).transpose(2, 0, 1))
+    image.SetSpacing((2.0, 2.0, 3.0))
+    return image
+
+
+def binary_masks():
+    masks = {name: np.zeros(SHAPE, dtype=bool) for name in ('lung', 'L/R lung', 'Lung', 'empty')}
+    masks['lung'][2:7, 3:5, 1:4] = True
+    masks['L/R lung'][0, 0, 0] = True
+    masks['L/R lung'][-1, -1, -1] = True
+    masks['Lung'][5:9, 1:8, 2] = True
+    return masks
+
+
+@pytest.mark.parametrize('seg_format', ['npy', 'packed', 'npz'])
+def test_binary_round_trip(tmp_path, seg_format):
+    masks = binary_masks()
+    image = grid_image()
+    save_hedos_inputs(image, masks, image, str(tmp_path), seg_format=seg_format)
+
+    segs = open_segmentations(str(tmp_path))
+    assert list(segs.files) == list(masks)
+    for name, mask in masks.items():
+        np.testing.assert_array_equal(np.asarray(segs[name]) != 0, mask)
+    dose = np.load(os.path.join(tmp_path, 'dose.npy'))
+    np.testing.assert_array_equal(dose, sitk.GetArrayFromImage(image).transpose(1, 2, 0))
+    # only one format is kept:
+    assert os.path.isfile(os.path.join(tmp_path, 'compressed_segs.npz')) == (seg_format == 'npz')
+    assert os.path.isfile(os.path.join(tmp_path, 'segs', 'segs.json')) == (seg_format != 'npz')
+
+
+@pytest.mark.parametrize('seg_format', ['npy', 'packed'])
+def test_store_files_are_sanitized_crops(tmp_path, seg_format):
+    masks = binary_masks()
+    image = grid_image()
+    save_hedos_inputs(image, masks, image, str(tmp_path), seg_format=seg_format)
+
+    with open(os.path.join(tmp_path, 'segs', 'segs.json')) as f:
+        manifest = json.load(f)
+    assert manifest['files'] == {'lung': 'lung.npy', 'L/R lung': 'L_R_lung.npy', 'Lung': 'Lung_2.npy'}
+    assert manifest['bboxes']['empty'] is None
+    assert manifest['bboxes']['lung'] == [[2, 7], [3, 5], [1, 4]]
+    assert sorted(os.listdir(os.path.join(tmp_path, 'segs'))) == ['L_R_lung.npy', 'Lung_2.npy', 'lung.npy', 'segs.json']
+
+    segs = SegmentationStore(os.path.join(tmp_path, 'segs'))
+    bbox, cropped = segs.get_cropped('lung')
+    assert cropped.shape == (5, 2, 3) and cropped.all()
+    assert segs.get_cropped('empty') == (None, None)
+    assert segs['empty'].shape == SHAPE and not segs['empty'].any()
+
+
+def test_fractional_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    fractions = {'lung': np.zeros(SHAPE, dtype=np.float32), 'heart': np.zeros(SHAPE, dtype=np.float32)}
+    fractions['lung'][1:6, 2:9, 0:5] = rng.uniform(0.0, 1.0, size=(5, 7, 5))
+    fractions['heart'][7:11, 0:3, 3:6] = 1.0
+    image = grid_image()
+    save_hedos_inputs(image, fractions, image, str(tmp_path), fractional=True)
+
+    segs = open_segmentations(str(tmp_path))
+    assert segs.fractional
+    for name, expected in fractions.items():
+        assert segs[name].dtype == np.float32
+        np.testing.assert_allclose(segs[name], expected, atol=0.5 / 255)
+
+    with pytest.raises(ValueError):
+        save_hedos_inputs(image, fractions, image, str(tmp_path), seg_format='packed', fractional=True)
+
+
+def test_rewrite_removes_stale_files(tmp_path):
+    image = grid_image()
+    save_hedos_inputs(image, binary_masks(), image, str(tmp_path))
+    masks = {'heart': np.zeros(SHAPE, dtype=bool)}
+    masks['heart'][1:3, 1:3, 1:3] = True
+    save_hedos_inputs(image, masks, image, str(tmp_path))
+    assert sorted(os.listdir(os.path.join(tmp_path, 'segs'))) == ['heart.npy', 'segs.json']
+    np.testing.assert_array_equal(open_segmentations(str(tmp_path))['heart'] != 0, masks['heart'])
@@ -0,0 +1,41 @@
+from simulation import FlowModelFactory, DoseRate, AnalyticalDose
+
+
+def blood_dose_moments(simulation_params, patient_params, treatment_params, patient, model=None):
+    """
+    Fast, deterministic alternative to BloodDoseFromFields for plan screening:
+    returns the AnalyticalDose with the mean and variance of the blood dose (no particle simulation).
+    patient : a loaded Patient, holding the dose of the plan under consideration.
+    model   : optionally, a flow model to re-use when screening many plans of the same patient.
+    """
+    # ======= Step 1. Initialize flow model ============================= #
+    if model is None:
+        filename = '../input/phantom/ICRP89_compartment_model.xlsx'
+        model_factory = FlowModelFactory(filename, simulation_params, sheet_names=[patient_params['sheet_name']])
+        # rescale to the patient and add the tumor and any additional lesion/nodal boxes:
+        model = model_factory.create(patient_params)
+    # ============================================================== #
+
+    # ======== Step 2. Solve for the blood dose moments ============ #
+    dose = DoseRate(patient, n_fractions=treatment_params['nr_fractions'],
+                    total_beam_on_time=treatment_params['total_beam_on_time'])
+
+    # per-beam doses (named by the treatment beam names) give every beam its own dose rate, see BloodDoseFromFields
+    beams = list(zip(treatment_params['start_times'], treatment_params['beam_on_times']))
+    beam_names = patient.match_beam_names(treatment_params['beam_names'])
+
+    blood_dose = AnalyticalDose(model)
+    compartment_ids = [[i for i, name in enumerate(model.names) if organ in name] for organ in patient_params['organs']]
+    for organ, compartment_id in zip(patient_params['organs'], compartment_ids):
+        for i, (start_time, beam_on_time) in enumerate(beams):
+            if beam_names is None:
+                dose_rate_hist = dose.get_dose_rate_hist(organ)
+            else:
+                dose_rate_hist = dose.get_beam_dose_rate_hist(organ, beam_names[i], beam_on_time)
+            blood_dose.add_dose(dose_rate_hist, compartment_id, start_time=start_time, beam_on_time=beam_on_time)
+    blood_dose.solve()
+    if simulation_params['accumulate']:
+        blood_dose.repeat(treatment_params['nr_fractions'])
+    print('Mean blood dose = {:.4f} Gy, std = {:.4f} Gy'.format(blood_dose.mean, blood_dose.var ** 0.5))
+    return blood_dose
+    # ============================================================== #
@@ -1,23 +1,23 @@
 import numpy as np
 
-from simulation import ExpandFlowModel, TemporalDistribution, DoseRateFromDVH, CompartmentDose
+from simulation import FlowModelFactory, TemporalDistribution, DoseRateFromDVH, CompartmentDose
 from PlotDoseDistribution import plot_dose_distribution
 
 
-def blood_dose_distribution(simulation_params, patient_params, treatment_params):
+def blood_dose_distribution(simulation_params, patient_params, treatment_params, model_factory=None):
 
     # ======= Step 1. Initialize simulation ============================= #
     filename = '../input/phantom/ICRP89_compartment_model.xlsx'
-    model = ExpandFlowModel(filename, patient_params, simulation_params)
-    # add the tumor:
-    if 'tumor' in patient_params['organs']:
-        model.split_box_parallel('tumor', box_dict=patient_params)
+    if model_factory is None:
+        model_factory = FlowModelFactory(filename, simulation_params, sheet_names=[patient_params['sheet_name']])
+    # rescale to the patient and add the tumor and any additional lesion/nodal boxes:
+    model = model_factory.create(patient_params)
     # ============================================================== #
 
     # ======== Step 2. Generate distribution ======================= #
     blood = TemporalDistribution(model)
     if simulation_params['generate_new']:
-        model.construct_weibull()
+        model.construct_weibull(multi_rate=simulation_params['multi_rate'])
         blood.generate_from_weibull()
         blood.save('../input/blood_path.npy')
 
@@ -36,6 +36,8 @@ def blood_dose_distribution(simulation_params, patient_params, treatment_params)
     # ============================================================== #
 
     # ======== Step 3. Accumulate dose ============================= #
+    if treatment_params['beam_names'] is not None:
+        raise ValueError('DVHs hold the total dose, per-beam doses need BloodDoseFromFields.')
     dose = DoseRateFromDVH(n_fractions=treatment_params['nr_fractions'],
                            total_beam_on_time=treatment_params['total_beam_on_time'])
 
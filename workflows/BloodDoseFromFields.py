@@ -1,10 +1,12 @@
-from simulation import ExpandFlowModel, TemporalDistribution, DoseRate, CompartmentDose, Patient
+from simulation import FlowModelFactory, TemporalDistribution, DoseRate, CompartmentDose, Patient
 from PlotDoseDistribution import plot_dose_distribution
 
 
-def blood_dose_distribution(simulation_params, patient_params, treatment_params):
+def blood_dose_distribution(simulation_params, patient_params, treatment_params, model_factory=None):
     patient = Patient()
     patient.read_from_numpy('../input/patient', patient_params['organs'], plot=True)
+    # only keep the irradiated region of the organs:
+    patient.crop_to_dose(threshold=0.01)
     patient.write_dvh('../input/patient/DVHs', patient_params['organs'])
     # patient.get_tumor_volume_fraction(patient_params['tumor_site'], 'tumor')
     # patient_params['tumor_volume_fraction'] = patient.tumor_volume_fraction
@@ -12,16 +14,16 @@ def blood_dose_distribution(simulation_params, patient_params, treatment_params)
 
     # ======= Step 1. Initialize simulation ============================= #
     filename = '../input/phantom/ICRP89_compartment_model.xlsx'
-    model = ExpandFlowModel(filename, patient_params, simulation_params)
-    # add the tumor:
-    if 'tumor' in patient_params['organs']:
-        model.split_box_parallel('tumor', box_dict=patient_params)
+    if model_factory is None:
+        model_factory = FlowModelFactory(filename, simulation_params, sheet_names=[patient_params['sheet_name']])
+    # rescale to the patient and add the tumor and any additional lesion/nodal boxes:
+    model = model_factory.create(patient_params)
     # ============================================================== #
 
     # ======== Step 2. Generate distribution ======================= #
     blood = TemporalDistribution(model)
     if simulation_params['generate_new']:
-        model.construct_weibull()
+        model.construct_weibull(multi_rate=simulation_params['multi_rate'])
         blood.generate_from_weibull()
         blood.save('../input/blood_path.npy')
     else:
@@ -40,18 +42,37 @@ def blood_dose_distribution(simulation_params, patient_params, treatment_params)
                     total_beam_on_time=treatment_params['total_beam_on_time'])
     dose.get_dose_rate()
 
+    # with the beam names of the fields (matching the per-beam doses converted from per-beam RTDOSE files),
+    # every beam applies its own dose rate during its beam-on time; otherwise the total dose is spread
+    # uniformly over all beams.
+    beams = list(zip(treatment_params['start_times'], treatment_params['beam_on_times']))
+    beam_names = patient.match_beam_names(treatment_params['beam_names'])
+    if beam_names is not None:
+        print('Using the dose rates of beams {}.'.format(', '.join(beam_names)))
+    if simulation_params['random_walk']:
+        if beam_names is None:
+            dose_rate_funcs = [dose.dose_rate_func] * len(beams)
+        else:
+            dose_rate_funcs = [dose.get_beam_dose_rate_func(beam_name, beam_on_time)
+                               for beam_name, (_, beam_on_time) in zip(beam_names, beams)]
+
     compartment_ids = [[i for i, name in enumerate(model.names) if organ in name] for organ in patient_params['organs']]
     dose_contributions = {}
     for organ, compartment_id in zip(patient_params['organs'], compartment_ids):
         blood_dose = CompartmentDose(blood.path, model.dt)
         if simulation_params['random_walk']:
-            blood_dose.prepare(patient.gridpoints, patient.seg_organs[organ], down_sample=(2, 2, 1))
-            for start_time, beam_on_time in zip(treatment_params['start_times'], treatment_params['beam_on_times']):
-                blood_dose.add_dose_random_walk(dose.dose_rate_func, compartment_id,
+            blood_dose.prepare(patient.gridpoints, patient.seg_organs[organ], down_sample=(2, 2, 1),
+                               outside_fraction=patient.get_outside_fraction(organ),
+                               spacing=patient.get_voxel_spacing())
+            for dose_rate_func, (start_time, beam_on_time) in zip(dose_rate_funcs, beams):
+                blood_dose.add_dose_random_walk(dose_rate_func, compartment_id,
                                                 start_time=start_time, beam_on_time=beam_on_time)
         else:
-            dose_rate_hist = dose.get_dose_rate_hist(organ)
-            for start_time, beam_on_time in zip(treatment_params['start_times'], treatment_params['beam_on_times']):
+            for i, (start_time, beam_on_time) in enumerate(beams):
+                if beam_names is None:
+                    dose_rate_hist = dose.get_dose_rate_hist(organ)
+                else:
+                    dose_rate_hist = dose.get_beam_dose_rate_hist(organ, beam_names[i], beam_on_time)
                 blood_dose.add_dose(dose_rate_hist, compartment_id, start_time=start_time, beam_on_time=beam_on_time)
         dose_contributions[organ] = blood_dose.dose
 